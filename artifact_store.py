@@ -0,0 +1,167 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Store shared by every session and process of the app, next to this module
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'letter_store')
+
+# Total size the store is trimmed back under once it grows past it
+STORE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Eviction trims the store to this fraction of max_bytes so it doesn't run on every write
+STORE_EVICT_TO = 0.9
+
+# Lock file serializing eviction between processes
+EVICT_LOCK_NAME = '.evict.lock'
+
+# Temporary files left this long (in seconds) belong to a writer that died and are removed
+STALE_TEMP_SECONDS = 3600
+
+def write_file_atomic(path, data):
+    """Write `data` to `path` through a temporary file so readers never see a partial file"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+@contextmanager
+def _file_lock(path):
+    """Hold an exclusive lock on `path` across processes where the platform supports it"""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class ArtifactStore:
+    """Rendered letters on disk, addressed by letter_cache_key (row content plus template version)
+
+    Each letter format is a file named after the key, sharded by the key's
+    first two characters. Files are written atomically and never modified
+    afterwards, so any number of sessions and processes can read and write
+    the store at once; a letter that is half-written or evicted mid-read is
+    simply a miss. Once roughly `max_bytes` are stored, the least recently
+    used letters are deleted.
+    """
+
+    def __init__(self, root=DEFAULT_STORE_DIR, max_bytes=STORE_MAX_BYTES, formats=('docx', 'html')):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.formats = tuple(formats)
+        self.lock = threading.Lock()
+        # Bytes this process has written since it last checked the store's size
+        self.bytes_since_check = max_bytes
+
+    def paths(self, key):
+        shard = os.path.join(self.root, key[:2])
+        return [os.path.join(shard, f"{key}.{letter_format}") for letter_format in self.formats]
+
+    def get(self, key):
+        """Return the stored letter as a tuple of bytes per format, or None"""
+        letter = []
+        paths = self.paths(key)
+        for path in paths:
+            try:
+                with open(path, 'rb') as letter_file:
+                    letter.append(letter_file.read())
+            except OSError:
+                return None
+
+        # Mark the letter as recently used for eviction
+        try:
+            os.utime(paths[0])
+        except OSError:
+            pass
+        return tuple(letter)
+
+    def put(self, key, letter):
+        """Store a letter's bytes (one per format) under `key`"""
+        paths = self.paths(key)
+        os.makedirs(os.path.dirname(paths[0]), exist_ok=True)
+        # The first format is written last, so a reader that finds it finds the rest too
+        for path, data in reversed(list(zip(paths, letter))):
+            write_file_atomic(path, data)
+
+        with self.lock:
+            self.bytes_since_check += sum(len(data) for data in letter)
+            check = self.bytes_since_check > self.max_bytes * (1 - STORE_EVICT_TO)
+            if check:
+                self.bytes_since_check = 0
+        if check:
+            self.evict()
+
+    def _scan(self):
+        """Return {key: [last used time, total bytes, paths]} for every stored letter"""
+        letters = {}
+        stale_before = time.time() - STALE_TEMP_SECONDS
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.startswith('.tmp-'):
+                    if stat.st_mtime < stale_before:
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
+                    continue
+                key, extension = os.path.splitext(entry.name)
+                if extension[1:] not in self.formats:
+                    continue
+                used, size, paths = letters.setdefault(key, [0, 0, []])
+                letters[key][0] = max(used, stat.st_mtime)
+                letters[key][1] = size + stat.st_size
+                paths.append(entry.path)
+        return letters
+
+    def size(self):
+        """Return the total bytes held in the store"""
+        if not os.path.isdir(self.root):
+            return 0
+        return sum(size for used, size, paths in self._scan().values())
+
+    def evict(self):
+        """Delete least recently used letters until the store is back under its size limit"""
+        if not os.path.isdir(self.root):
+            return
+        with _file_lock(os.path.join(self.root, EVICT_LOCK_NAME)):
+            letters = self._scan()
+            total = sum(size for used, size, paths in letters.values())
+            if total <= self.max_bytes:
+                return
+            target = self.max_bytes * STORE_EVICT_TO
+            for used, size, paths in sorted(letters.values(), key=lambda letter: letter[0]):
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= size
+                if total <= target:
+                    break
+
+    def clear(self):
+        """Delete every stored letter"""
+        if not os.path.isdir(self.root):
+            return
+        with _file_lock(os.path.join(self.root, EVICT_LOCK_NAME)):
+            for entry in os.scandir(self.root):
+                if entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
@@ -0,0 +1,308 @@
+"""Benchmark letter generation, HTML rendering and ZIP packaging at several batch sizes.
+
+Synthetic MP CSVs following the test_mp_data.csv schema are generated for each
+size and measured in a fresh process, so peak RSS reflects that size alone.
+Each size is run several times (--repeats) and every metric is the median of
+the runs. Results can be saved as a baseline and later runs compared against
+it; the comparison gates on median latencies, throughput and archive build
+times only, since tail latencies of a single run are mostly noise.
+
+    python benchmarks/letters.py                          # 16, 227, 2000 and 20000 rows
+    python benchmarks/letters.py --sizes 16 227 --save baseline.json
+    python benchmarks/letters.py --sizes 16 227 --baseline baseline.json --threshold 0.15
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+DEFAULT_SIZES = [16, 227, 2000, 20000]
+
+# Per-letter latency is sampled on at most this many rows per size
+DEFAULT_LATENCY_SAMPLE = 500
+
+# Distinct rendered letters recycled (under unique names) to fill the archives
+ARCHIVE_LETTER_POOL = 200
+
+FIRST_NAMES = ['Jodie', 'Carol', 'Sam', 'Leah', 'Mark', 'Anika', 'Zoë', 'Tim', 'Rebekha', "Seán"]
+LAST_NAMES = ['Belyea', 'Berry', 'Birrell', 'Blyth', 'Butler', 'Wells', "O'Neil", 'Nguyen', 'Smith-Jones']
+ELECTORATES = ['Dunkley', 'Whitlam', 'Nicholls', 'Hindmarsh', 'Kooyong', 'Fenner', 'Lingiari', 'Brand']
+STATES = ['SA', 'NSW', 'VIC', 'QLD', 'WA', 'TAS', 'ACT', 'NT']
+ROLES = [
+    'Member of Standing Committee on Health, Aged Care and Disability',
+    'Minister for Health and Ageing',
+    'Deputy Leader of the House',
+]
+
+# Metrics where a larger value is an improvement; everything else is a cost
+HIGHER_IS_BETTER = {'letters_per_s'}
+
+# Whole-operation timings shorter than this are too noisy to flag as regressions
+DEFAULT_MIN_DURATION_MS = 50.0
+
+# Per-letter median latencies shorter than this are at the timer's noise level
+MIN_LATENCY_MS = 0.1
+
+# Regression allowed before --baseline fails; a benchmark compared with its own rerun passes at this
+DEFAULT_THRESHOLD = 0.25
+
+# Runs per size; each metric is the median across them
+DEFAULT_REPEATS = 3
+
+# Metrics --baseline compares ('group.' matches the whole group); p90/p99/max stay report-only
+GATED_METRICS = (
+    'docx_latency_ms.p50', 'html_latency_ms.p50', 'pdf_latency_ms.p50', 'letters_per_s', 'archive_build_s.',
+)
+
+def write_synthetic_csv(path, rows, seed=0):
+    """Write an MP CSV with `rows` members and senators in the test_mp_data.csv schema"""
+    rng = random.Random(seed)
+    with open(path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['full_salutation', 'salutation', 'First name', 'Last name', 'State/Electorate', 'percentage_electorate'])
+        for index in range(rows):
+            first_name = rng.choice(FIRST_NAMES)
+            last_name = f"{rng.choice(LAST_NAMES)}{index}"
+            if rng.random() < 0.3:
+                state = rng.choice(STATES)
+                full_salutation = f"Senator {first_name} {last_name}\nSenator for {state}"
+                writer.writerow([full_salutation, f"Dear Senator {last_name}", first_name, last_name, state, ''])
+            else:
+                electorate = rng.choice(ELECTORATES)
+                lines = [f"Ms {first_name} {last_name} MP", f"Member for {electorate}"]
+                lines += rng.sample(ROLES, rng.randint(0, 2))
+                percentage = f"{rng.uniform(18, 32):.2f}%"
+                writer.writerow(["\n".join(lines), f"Dear Ms {last_name} ", first_name, last_name, electorate, percentage])
+
+def percentiles(samples_s):
+    """Return p50/p90/p99/max of a list of durations in seconds, in milliseconds"""
+    ordered = sorted(samples_s)
+    quantiles = statistics.quantiles(ordered, n=100, method='inclusive') if len(ordered) > 1 else ordered * 99
+    return {
+        'p50': quantiles[49] * 1000,
+        'p90': quantiles[89] * 1000,
+        'p99': quantiles[98] * 1000,
+        'max': ordered[-1] * 1000,
+    }
+
+def peak_rss_mb():
+    """Return this process's peak resident set size in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_size(rows, workers, latency_sample):
+    """Measure one batch size in this process and return its metrics"""
+    import pandas as pd
+    import letter_generator as lg
+
+    results = {'rows': rows, 'workers': workers}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'mps.csv')
+        write_synthetic_csv(csv_path, rows)
+
+        started = time.perf_counter()
+        mps_df = pd.read_csv(csv_path)
+        mp_records = lg.collect_mp_records(mps_df)
+        results['csv_parse_s'] = time.perf_counter() - started
+
+        # Warm the compiled templates so first-letter setup isn't counted as latency
+        started = time.perf_counter()
+        lg.get_compiled_docx_template()
+        lg.get_compiled_html_template()
+        pdf_renderer = lg.get_pdf_renderer()
+        results['template_compile_s'] = time.perf_counter() - started
+
+        # Per-letter latency for each format
+        docx_times, html_times, pdf_times = [], [], []
+        for mp_key, mp_data, base_filename in mp_records[:latency_sample]:
+            started = time.perf_counter()
+            lg.create_letter_from_template(mp_data)
+            docx_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            lg.create_html_letter(mp_data)
+            html_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            pdf_renderer.render(lg.letter_slots(mp_data))
+            pdf_times.append(time.perf_counter() - started)
+        results['docx_latency_ms'] = percentiles(docx_times)
+        results['html_latency_ms'] = percentiles(html_times)
+        results['pdf_latency_ms'] = percentiles(pdf_times)
+
+        # End-to-end throughput of the streaming pipeline (nothing retained)
+        started = time.perf_counter()
+        count = sum(1 for _ in lg.iter_letters(mps_df, workers=workers))
+        elapsed = time.perf_counter() - started
+        results['pipeline_s'] = elapsed
+        results['letters_per_s'] = count / elapsed if elapsed else 0.0
+
+        # Archive build time per format, from a pool of rendered letters under every MP's name
+        pool = [info for key, info in lg.iter_letters(mps_df.head(ARCHIVE_LETTER_POOL))]
+        letters = [
+            (mp_key, dict(pool[index % len(pool)], base_filename=base_filename))
+            for index, (mp_key, mp_data, base_filename) in enumerate(mp_records)
+        ]
+        archive_times = {}
+        # The pooled letters have no PDFs, so the pdf archive includes rendering them
+        for format_type in ('docx', 'html', 'both', 'pdf'):
+            started = time.perf_counter()
+            with lg.create_zip_file(letters, format_type, output=os.path.join(tmp_dir, f'{format_type}.zip')):
+                pass
+            archive_times[format_type] = time.perf_counter() - started
+        started = time.perf_counter()
+        for zip_file in lg.create_zip_files(letters).values():
+            zip_file.close()
+        archive_times['all_in_one_pass'] = time.perf_counter() - started
+        started = time.perf_counter()
+        with lg.create_merged_docx((mp_data for mp_key, mp_data, base_filename in mp_records),
+                                   output=os.path.join(tmp_dir, 'merged.docx')):
+            pass
+        archive_times['merged_docx'] = time.perf_counter() - started
+        results['merged_docx_kb'] = os.path.getsize(os.path.join(tmp_dir, 'merged.docx')) / 1024
+        results['archive_build_s'] = archive_times
+
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+def run_size_in_subprocess(rows, workers, latency_sample):
+    """Run one size in a fresh interpreter so its peak RSS isn't inflated by earlier sizes"""
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-size', str(rows),
+         '--workers', str(workers), '--latency-sample', str(latency_sample)],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def median_metrics(runs):
+    """Combine repeated runs of one size, taking the median of each timing"""
+    combined = {}
+    for name, value in runs[0].items():
+        if isinstance(value, dict):
+            combined[name] = median_metrics([run[name] for run in runs])
+        elif isinstance(value, float):
+            combined[name] = statistics.median(run[name] for run in runs)
+        else:
+            combined[name] = value
+    return combined
+
+def is_gated(name):
+    return any(name == metric or (metric.endswith('.') and name.startswith(metric)) for metric in GATED_METRICS)
+
+def flatten(metrics, prefix=''):
+    """Flatten nested metric dicts into {'a.b': value}"""
+    flat = {}
+    for name, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{name}."))
+        elif isinstance(value, float):
+            flat[f"{prefix}{name}"] = value
+    return flat
+
+def duration_ms(name, value):
+    """Return a flattened timing metric in milliseconds, or None if it isn't a timing"""
+    group = name.split('.')[0]
+    if group in HIGHER_IS_BETTER:
+        return None
+    if group.endswith('_ms'):
+        return value
+    if group.endswith('_s'):
+        return value * 1000
+    return None
+
+def compare(results, baseline, threshold, min_duration_ms=DEFAULT_MIN_DURATION_MS):
+    """Return a list of regressions in GATED_METRICS larger than `threshold` (a fraction) against `baseline`"""
+    regressions = []
+    for size, metrics in results.items():
+        if size not in baseline:
+            continue
+        current, previous = flatten(metrics), flatten(baseline[size])
+        for name, value in current.items():
+            before = previous.get(name)
+            if not before or not is_gated(name):
+                continue
+            before_ms = duration_ms(name, before)
+            floor_ms = MIN_LATENCY_MS if name.split('.')[0].endswith('_ms') else min_duration_ms
+            if before_ms is not None and max(before_ms, duration_ms(name, value)) < floor_ms:
+                continue
+            change = (value - before) / before
+            if name.split('.')[0] in HIGHER_IS_BETTER:
+                change = -change
+            if change > threshold:
+                regressions.append(f"{size} rows: {name} {before:.4g} -> {value:.4g} ({change:+.0%})")
+    return regressions
+
+def print_report(results):
+    for size, metrics in results.items():
+        docx, html, pdf = metrics['docx_latency_ms'], metrics['html_latency_ms'], metrics['pdf_latency_ms']
+        archives = metrics['archive_build_s']
+        print(f"\n{size} rows")
+        print(f"  csv parse + normalize   {metrics['csv_parse_s'] * 1000:9.1f} ms")
+        print(f"  docx latency            p50 {docx['p50']:.2f}  p90 {docx['p90']:.2f}  p99 {docx['p99']:.2f} ms")
+        print(f"  html latency            p50 {html['p50']:.3f}  p90 {html['p90']:.3f}  p99 {html['p99']:.3f} ms")
+        print(f"  pdf latency             p50 {pdf['p50']:.2f}  p90 {pdf['p90']:.2f}  p99 {pdf['p99']:.2f} ms")
+        print(f"  pipeline throughput     {metrics['letters_per_s']:9.1f} letters/s ({metrics['workers']} worker(s))")
+        print("  archive build           " + "  ".join(f"{name} {seconds:.2f}s" for name, seconds in archives.items()))
+        print(f"  merged docx size        {metrics['merged_docx_kb']:9.1f} KB")
+        print(f"  peak RSS                {metrics['peak_rss_mb']:9.1f} MB")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark MP letter generation and packaging.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help=f"row counts to benchmark (default: {' '.join(map(str, DEFAULT_SIZES))})")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker processes for the pipeline throughput run (default: 1)")
+    parser.add_argument('--latency-sample', type=int, default=DEFAULT_LATENCY_SAMPLE,
+                        help=f"rows timed individually per size (default: {DEFAULT_LATENCY_SAMPLE})")
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS,
+                        help=f"runs per size, combined by median (default: {DEFAULT_REPEATS})")
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare against results saved earlier with --save")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"fail when a gated metric regresses by more than this fraction (default: {DEFAULT_THRESHOLD:g})")
+    parser.add_argument('--min-duration-ms', type=float, default=DEFAULT_MIN_DURATION_MS,
+                        help=f"ignore timings below this when comparing (default: {DEFAULT_MIN_DURATION_MS:g})")
+    parser.add_argument('--run-size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_size is not None:
+        print(json.dumps(run_size(args.run_size, args.workers, args.latency_sample)))
+        return 0
+
+    results = {}
+    for rows in args.sizes:
+        print(f"Benchmarking {rows} rows...", file=sys.stderr)
+        runs = [run_size_in_subprocess(rows, args.workers, args.latency_sample) for _ in range(max(1, args.repeats))]
+        results[str(rows)] = median_metrics(runs)
+
+    print_report(results)
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+        print(f"\nSaved results to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold, args.min_duration_ms)
+        if regressions:
+            print(f"\nRegressions beyond {args.threshold:.0%}:\n  " + "\n  ".join(regressions))
+            return 1
+        print(f"\nNo regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""Check the cold-start import cost of the app's entry modules against a budget.
+
+Each module is imported in a fresh interpreter under ``python -X importtime``.
+The check fails if the import takes longer than its budget, or if it pulls in a
+heavy dependency that should only load once the code path needing it runs.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --budget-scale 2    # slower CI machines
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module: (import budget in milliseconds, packages it must not import)
+STARTUP_BUDGETS = {
+    'letter_generator': (100, ['pandas', 'docx', 'streamlit', 'multiprocessing']),
+    'cli': (120, ['pandas', 'docx', 'streamlit', 'multiprocessing']),
+    'app': (800, ['pandas', 'docx']),
+}
+
+def measure_import(module, runs=5):
+    """Return (best cumulative import time in ms, top-level packages imported) for `module`"""
+    best_us = None
+    imported = set()
+
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        )
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            if not cumulative_us.strip().isdigit():
+                continue  # header line
+            imported.add(name.strip().split('.')[0])
+            if name == f' {module}':  # the top-level entry, not a nested import
+                cumulative = int(cumulative_us)
+                best_us = cumulative if best_us is None else min(best_us, cumulative)
+
+    return best_us / 1000, imported
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check import-time budgets for the app's entry modules.")
+    parser.add_argument('--budget-scale', type=float, default=1.0,
+                        help="multiply every budget by this factor (default: 1.0)")
+    parser.add_argument('--runs', type=int, default=5,
+                        help="fresh interpreters per module; the fastest run is used (default: 5)")
+    args = parser.parse_args(argv)
+
+    failures = []
+    for module, (budget_ms, forbidden) in STARTUP_BUDGETS.items():
+        elapsed_ms, imported = measure_import(module, args.runs)
+        budget_ms *= args.budget_scale
+        loaded = sorted(set(forbidden) & imported)
+
+        status = 'ok'
+        if elapsed_ms > budget_ms:
+            status = 'OVER BUDGET'
+            failures.append(f"{module} took {elapsed_ms:.1f} ms (budget {budget_ms:.0f} ms)")
+        if loaded:
+            status = 'HEAVY IMPORTS'
+            failures.append(f"{module} imports {', '.join(loaded)} at startup")
+
+        print(f"{module:<18} {elapsed_ms:8.1f} ms  budget {budget_ms:6.0f} ms  {status}")
+
+    if failures:
+        print("\nStartup check failed:\n  " + "\n  ".join(failures))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
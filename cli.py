@@ -0,0 +1,174 @@
+"""Generate MP letters from the command line, without starting Streamlit.
+
+Examples:
+    python cli.py mps.csv -o letters.zip --workers 4
+    python cli.py mps.csv -o letters/ --mode files --formats docx
+    python cli.py mps.csv -o letters.zip --formats docx html pdf
+    python cli.py mps.csv -o all_letters.docx --mode merged
+    python cli.py mps.csv -o letters.zip --template spring_campaign.txt
+    python cli.py mps.csv -o letters/ --mode files --incremental
+"""
+import argparse
+import os
+import sys
+import time
+
+from artifact_store import ArtifactStore, DEFAULT_STORE_DIR
+from incremental import IncrementalBuild
+from ingestion import read_columns, iter_mp_frames, INGEST_BATCH_ROWS
+from letter_template import load_letter_template, TemplateError, TEMPLATE_ENV_VAR
+from letter_generator import (
+    iter_letters, iter_mp_records, create_zip_file, create_merged_docx, letter_base_filename, find_missing_columns,
+    LetterCache,
+    ARCHIVE_FORMATS, DEFAULT_CHUNKSIZE, REQUIRED_COLUMNS
+)
+
+LETTER_FORMATS = ['docx', 'html', 'pdf']
+
+# Formats written when --formats is not given
+DEFAULT_FORMATS = ['docx', 'html']
+
+def archive_format_type(formats):
+    """Map the requested letter formats onto a create_zip_file format_type, or None if there is none"""
+    for format_type, archive_formats in ARCHIVE_FORMATS.items():
+        if set(archive_formats) == set(formats):
+            return format_type
+    return None
+
+def write_letter_files(letters, output_dir, formats):
+    """Write each letter as a flat file in `output_dir` and return how many MPs were written"""
+    os.makedirs(output_dir, exist_ok=True)
+    count = 0
+
+    for mp_key, mp_info in letters:
+        base_filename = letter_base_filename(mp_info)
+
+        if 'docx' in formats:
+            with open(os.path.join(output_dir, f"{base_filename}.docx"), 'wb') as docx_file:
+                docx_file.write(mp_info['doc_buffer'].getbuffer())
+
+        if 'html' in formats:
+            with open(os.path.join(output_dir, f"{base_filename}.html"), 'wb') as html_file:
+                html_file.write(mp_info['html_buffer'].getbuffer())
+
+        if 'pdf' in formats:
+            with open(os.path.join(output_dir, f"{base_filename}.pdf"), 'wb') as pdf_file:
+                pdf_file.write(mp_info['pdf_buffer'].getbuffer())
+
+        count += 1
+
+    return count
+
+def count_letters(letters, counter):
+    """Pass letters through while counting them"""
+    for letter in letters:
+        counter[0] += 1
+        yield letter
+
+def default_state_dir(output):
+    """Return the directory an incremental archive run keeps its letters in"""
+    return f"{os.path.splitext(output)[0]}_letters"
+
+def describe_changes(changes):
+    return (f"{len(changes['added'])} added, {len(changes['changed'])} changed, "
+            f"{len(changes['removed'])} removed, {changes['unchanged']} unchanged")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Generate CARE Index letters for every MP in a CSV file.")
+    parser.add_argument('csv', help="MP CSV or Excel (.xlsx) file with columns: " + ", ".join(REQUIRED_COLUMNS))
+    parser.add_argument('-o', '--output', required=True,
+                        help="ZIP file to write (archive mode), directory to write into (files mode) "
+                             "or DOCX file to write (merged mode)")
+    parser.add_argument('-f', '--formats', nargs='+', choices=LETTER_FORMATS, default=DEFAULT_FORMATS,
+                        help="letter formats to produce (default: docx html)")
+    parser.add_argument('-m', '--mode', choices=['archive', 'files', 'merged'],
+                        help="write one ZIP archive, flat files, or every letter in one DOCX for printing "
+                             "(default: archive if OUTPUT ends in .zip, merged if it ends in .docx)")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="worker processes used to render letters (default: 1)")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE,
+                        help=f"rows handed to a worker at a time (default: {DEFAULT_CHUNKSIZE})")
+    parser.add_argument('--batch-rows', type=int, default=INGEST_BATCH_ROWS,
+                        help=f"rows read from the file at a time (default: {INGEST_BATCH_ROWS})")
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help="re-render only MPs added or changed since the last run, using the manifest "
+                             "kept with the letters")
+    parser.add_argument('--state-dir',
+                        help="where an incremental archive run keeps its letters and manifest "
+                             "(default: OUTPUT without .zip, plus _letters)")
+    parser.add_argument('-t', '--template',
+                        help="letter template file to use instead of letter_template.txt")
+    parser.add_argument('--store', nargs='?', const=DEFAULT_STORE_DIR, metavar='DIR',
+                        help="reuse letters rendered by earlier runs (and the app) from this on-disk store "
+                             f"(default DIR: {DEFAULT_STORE_DIR})")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    mode = args.mode or {'.zip': 'archive', '.docx': 'merged'}.get(os.path.splitext(args.output)[1].lower(), 'files')
+    formats = [letter_format for letter_format in LETTER_FORMATS if letter_format in args.formats]
+    if mode == 'merged' and args.incremental:
+        parser.error("--incremental doesn't apply to merged output, which is rebuilt in one pass")
+    if mode == 'archive' and archive_format_type(formats) is None:
+        parser.error(f"an archive can't hold just {' and '.join(formats)}; use --mode files or add formats")
+
+    if args.template:
+        # Set in the environment so worker processes load the same template
+        os.environ[TEMPLATE_ENV_VAR] = os.path.abspath(args.template)
+    try:
+        load_letter_template()
+    except (OSError, TemplateError) as e:
+        parser.exit(1, f"Error loading letter template: {e}\n")
+
+    started = time.perf_counter()
+    try:
+        columns = read_columns(args.csv)
+    except Exception as e:
+        parser.exit(1, f"Error loading MP file: {e}\n")
+
+    missing_cols = find_missing_columns(columns)
+    if missing_cols:
+        parser.error(f"MP file is missing required columns: {', '.join(missing_cols)}")
+
+    # Rows are read a batch at a time as letters are generated
+    mps_frames = iter_mp_frames(args.csv, batch_rows=max(1, args.batch_rows))
+    cache = LetterCache(store=ArtifactStore(args.store)) if args.store else None
+
+    if mode == 'merged':
+        # Only the slot values are needed; no per-letter package is rendered
+        mp_records = iter_mp_records(mps_frames)
+        merged_file = create_merged_docx((mp_data for mp_key, mp_data, base_filename in mp_records), output=args.output)
+        merged_file.close()
+        elapsed = time.perf_counter() - started
+        print(f"Merged letters into {args.output} in {elapsed:.1f}s")
+        return 0
+
+    if args.incremental:
+        # Files mode regenerates the output directory in place
+        state_dir = args.output if mode == 'files' else (args.state_dir or default_state_dir(args.output))
+        build = IncrementalBuild(state_dir, formats)
+        changes = build.update(mps_frames, workers=args.workers, chunksize=args.chunksize, cache=cache)
+        print(f"Incremental update of {state_dir}: {describe_changes(changes)}")
+        letters = build.iter_letters()
+    else:
+        letters = iter_letters(
+            mps_frames, workers=args.workers, chunksize=args.chunksize, cache=cache, pdf='pdf' in formats
+        )
+
+    if mode == 'archive':
+        counter = [0]
+        zip_file = create_zip_file(count_letters(letters, counter), archive_format_type(formats), output=args.output)
+        zip_file.close()
+        count = counter[0]
+    elif args.incremental:
+        count = len(build.letters)
+    else:
+        count = write_letter_files(letters, args.output, formats)
+
+    elapsed = time.perf_counter() - started
+    print(f"Generated {count} letters ({', '.join(formats)}) into {args.output} in {elapsed:.1f}s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import hashlib
+import io
+import json
+import os
+import threading
+
+from artifact_store import write_file_atomic
+from instrumentation import NULL_REPORT
+from letter_generator import (
+    iter_mp_records, iter_record_letters, letter_cache_key, template_version, DEFAULT_CHUNKSIZE
+)
+
+# Manifest of the last run, kept alongside the letters it describes
+MANIFEST_NAME = 'manifest.json'
+
+# Bump when the manifest layout changes so older manifests are ignored
+MANIFEST_VERSION = 1
+
+# Working directory the Streamlit app regenerates into
+DEFAULT_INCREMENTAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generated_letters')
+
+# mp_info buffer holding each letter format
+LETTER_BUFFERS = {
+    'docx': 'doc_buffer',
+    'html': 'html_buffer',
+    'pdf': 'pdf_buffer',
+}
+
+# One lock per directory so concurrent sessions in this process take turns using it;
+# reentrant so a caller holding it through locked() can still call update()
+_directory_locks = {}
+_directory_locks_guard = threading.Lock()
+
+def _directory_lock(path):
+    with _directory_locks_guard:
+        return _directory_locks.setdefault(os.path.abspath(path), threading.RLock())
+
+def file_hash(data):
+    """Return the SHA-256 hex digest of a letter file's bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+class IncrementalBuild:
+    """Letters kept as flat files in a directory, with a manifest of the run that produced them
+
+    The manifest records each MP's key, a hash of its row content and the
+    template version (letter_cache_key), and the hash of every output file.
+    update() diffs a new CSV against it, renders only MPs that were added or
+    changed, reuses untouched files as-is and deletes the files of MPs that
+    are no longer listed.
+    """
+
+    def __init__(self, output_dir, formats=('docx', 'html')):
+        self.output_dir = output_dir
+        self.formats = tuple(formats)
+        self.manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+        self.letters = self.load_manifest()
+
+    def load_manifest(self):
+        """Return {mp_key: entry} from the manifest, or {} if there is no usable one"""
+        try:
+            with open(self.manifest_path, encoding='utf-8') as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('version') != MANIFEST_VERSION:
+            return {}
+        return manifest.get('letters', {})
+
+    def save_manifest(self):
+        manifest = {'version': MANIFEST_VERSION, 'template_version': template_version(), 'letters': self.letters}
+        write_file_atomic(self.manifest_path, json.dumps(manifest, ensure_ascii=False, indent=1).encode('utf-8'))
+
+    def letter_path(self, base_filename, letter_format):
+        return os.path.join(self.output_dir, f"{base_filename}.{letter_format}")
+
+    def _is_reusable(self, entry, row_hash, base_filename):
+        """Check an entry matches the new row and its files are still on disk unmodified"""
+        if entry is None or entry['row_hash'] != row_hash or entry['base_filename'] != base_filename:
+            return False
+        for letter_format in self.formats:
+            expected = entry['files'].get(letter_format)
+            try:
+                with open(self.letter_path(base_filename, letter_format), 'rb') as letter_file:
+                    if expected is None or file_hash(letter_file.read()) != expected:
+                        return False
+            except OSError:
+                return False
+        return True
+
+    def locked(self):
+        """Return the directory's lock, to hold while reading the letters back
+
+        update() takes it itself. Hold it around load_manifest() or
+        iter_letters() (and whatever consumes them), or another run's update()
+        could rewrite or delete the files midway.
+        """
+        return _directory_lock(self.output_dir)
+
+    def update(self, mps_data, workers=1, chunksize=DEFAULT_CHUNKSIZE, cache=None, report=NULL_REPORT, progress=None):
+        """Bring the directory in line with `mps_data` (a DataFrame or DataFrame batches) and return what changed
+
+        Returns {'added': [...], 'changed': [...], 'removed': [...]} of MP keys
+        and the 'unchanged' count. `progress`, if given, is called with the
+        number of letters completed each time some are reused or written.
+        """
+        with _directory_lock(self.output_dir):
+            os.makedirs(self.output_dir, exist_ok=True)
+            previous = self.load_manifest()
+            version = template_version()
+
+            mp_records = list(iter_mp_records(mps_data, report))
+
+            # Diff the rows against the previous run
+            changes = {'added': [], 'changed': [], 'removed': [], 'unchanged': 0}
+            letters = {}
+            to_render = []
+            with report.stage('manifest_diff'):
+                for mp_key, mp_data, base_filename in mp_records:
+                    row_hash = letter_cache_key(mp_data, version)
+                    entry = previous.get(mp_key)
+                    if self._is_reusable(entry, row_hash, base_filename):
+                        files = {letter_format: entry['files'][letter_format] for letter_format in self.formats}
+                        letters[mp_key] = dict(entry, files=files)
+                        changes['unchanged'] += 1
+                    else:
+                        changes['changed' if mp_key in previous else 'added'].append(mp_key)
+                        to_render.append((mp_key, mp_data, base_filename))
+                current_keys = {mp_key for mp_key, mp_data, base_filename in mp_records}
+                changes['removed'] = [mp_key for mp_key in previous if mp_key not in current_keys]
+            report.count('letters_reused', changes['unchanged'])
+            if progress is not None and changes['unchanged']:
+                progress(changes['unchanged'])
+
+            # Render the added and changed MPs and write their files
+            rendered = iter_record_letters(
+                to_render, workers=workers, chunksize=chunksize, cache=cache, report=report, pdf='pdf' in self.formats
+            )
+            for mp_key, mp_info in rendered:
+                files = {}
+                with report.stage('letter_write'):
+                    for letter_format in self.formats:
+                        data = mp_info[LETTER_BUFFERS[letter_format]].getvalue()
+                        write_file_atomic(self.letter_path(mp_info['base_filename'], letter_format), data)
+                        files[letter_format] = file_hash(data)
+                letters[mp_key] = {
+                    'row_hash': letter_cache_key(mp_info['mp_data'], version),
+                    'base_filename': mp_info['base_filename'],
+                    'mp_data': mp_info['mp_data'],
+                    'files': files
+                }
+                if progress is not None:
+                    progress(1)
+
+            # Keep CSV order, then prune files no current letter owns
+            self.letters = {mp_key: letters[mp_key] for mp_key, mp_data, base_filename in mp_records}
+            current_files = {
+                self.letter_path(entry['base_filename'], letter_format)
+                for entry in self.letters.values() for letter_format in self.formats
+            }
+            with report.stage('prune'):
+                for entry in previous.values():
+                    for letter_format in entry['files']:
+                        path = self.letter_path(entry['base_filename'], letter_format)
+                        if path not in current_files and os.path.exists(path):
+                            os.remove(path)
+            report.count('letters_removed', len(changes['removed']))
+
+            self.save_manifest()
+            return changes
+
+    def iter_letters(self, formats=None):
+        """Yield (mp_key, mp_info) for every letter in the directory, read from disk in CSV order
+
+        Only the files of `formats` are read, all of the build's formats by default.
+        """
+        for mp_key, entry in self.letters.items():
+            mp_info = {'mp_data': entry['mp_data'], 'base_filename': entry['base_filename']}
+            for letter_format in formats or self.formats:
+                with open(self.letter_path(entry['base_filename'], letter_format), 'rb') as letter_file:
+                    mp_info[LETTER_BUFFERS[letter_format]] = io.BytesIO(letter_file.read())
+            yield mp_key, mp_info
@@ -0,0 +1,136 @@
+"""Read MP lists from CSV or Excel files a batch of rows at a time.
+
+Only the header is needed to validate a file, and generation consumes the rows
+as a stream of DataFrame batches, so memory stays flat however long the list is.
+pandas and openpyxl are imported when a file is read.
+"""
+import csv
+import io
+import os
+
+# Rows read into each DataFrame batch
+INGEST_BATCH_ROWS = 1000
+
+# File extensions read as Excel workbooks; anything else is read as CSV
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm')
+
+# Upload types accepted by the app
+SUPPORTED_FILE_TYPES = ['csv', 'xlsx', 'xlsm']
+
+def is_excel(name):
+    """Return True if `name` (a path or upload filename) is an Excel workbook"""
+    return os.path.splitext(str(name))[1].lower() in EXCEL_EXTENSIONS
+
+def _rewind(source):
+    """Move an uploaded file back to the start so it can be read again"""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+def _open_workbook(source):
+    """Open an Excel workbook in read-only streaming mode"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportError("Reading Excel files requires openpyxl (pip install openpyxl)") from None
+    _rewind(source)
+    return load_workbook(source, read_only=True, data_only=True)
+
+def _excel_cell_value(cell):
+    """Return a cell's value as the text the CSV export of the sheet would hold"""
+    value = cell.value
+    if value is None or isinstance(value, str):
+        return value
+
+    # Percentages are stored as fractions; show them the way the sheet does
+    number_format = cell.number_format or ''
+    if isinstance(value, (int, float)) and number_format.endswith('%'):
+        decimals = len(number_format.split('.')[1]) - 1 if '.' in number_format else 0
+        return f"{value * 100:.{decimals}f}%"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def _iter_excel_rows(source):
+    """Yield the header and then each non-empty row of the workbook's first sheet"""
+    workbook = _open_workbook(source)
+    try:
+        for row in workbook.worksheets[0].iter_rows():
+            values = [_excel_cell_value(cell) for cell in row]
+            if any(value not in (None, '') for value in values):
+                yield values
+    finally:
+        workbook.close()
+
+def _column_names(header):
+    """Name a sheet's header cells the way pandas names CSV columns, including blank ones"""
+    return [str(column) if column is not None else f"Unnamed: {index}" for index, column in enumerate(header)]
+
+def read_columns(source, name=None):
+    """Return the column names of a CSV or Excel file, reading only its header"""
+    name = name if name is not None else source
+    if is_excel(name):
+        rows = _iter_excel_rows(source)
+        try:
+            return _column_names(next(rows, []))
+        finally:
+            rows.close()
+
+    import pandas as pd
+    _rewind(source)
+    return list(pd.read_csv(source, nrows=0).columns)
+
+def count_rows(source, name=None):
+    """Count the data rows of a CSV or Excel file in one streaming pass"""
+    name = name if name is not None else source
+    if is_excel(name):
+        return max(0, sum(1 for row in _iter_excel_rows(source)) - 1)
+
+    # csv.reader understands quoted multi-line cells, which a line count would not
+    _rewind(source)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, newline='', encoding='utf-8-sig') as csv_file:
+            return max(0, sum(1 for row in csv.reader(csv_file) if row) - 1)
+    text = io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+    try:
+        return max(0, sum(1 for row in csv.reader(text) if row) - 1)
+    finally:
+        text.detach()
+
+def iter_mp_frames(source, name=None, batch_rows=INGEST_BATCH_ROWS):
+    """Yield the rows of a CSV or Excel file as DataFrames of up to `batch_rows` rows
+
+    Cells are read as text, so a value such as 26.10 keeps its trailing zero
+    however the rest of its column looks. Blank cells are read as '', never as
+    None or NaN, so they can't reach a letter as "None" or "nan".
+    """
+    import pandas as pd
+
+    name = name if name is not None else source
+    if is_excel(name):
+        rows = _iter_excel_rows(source)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = _column_names(header)
+        batch = []
+        for row in rows:
+            values = ['' if value is None else value for value in row[:len(columns)]]
+            batch.append(values + [''] * (len(columns) - len(values)))
+            if len(batch) == batch_rows:
+                yield pd.DataFrame(batch, columns=columns, dtype=object)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns, dtype=object)
+        return
+
+    _rewind(source)
+    with pd.read_csv(source, chunksize=batch_rows, dtype=str, keep_default_na=False) as reader:
+        yield from reader
+
+def read_preview(source, name=None, rows=5):
+    """Return the first `rows` rows of a CSV or Excel file as a DataFrame, or None if it has none"""
+    frames = iter_mp_frames(source, name, batch_rows=rows)
+    try:
+        return next(frames, None)
+    finally:
+        frames.close()
@@ -0,0 +1,138 @@
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# tracemalloc is process-wide, so only one report at a time may start, reset and stop it
+_memory_tracking = threading.Lock()
+
+class RunReport:
+    """Timing and allocation counters for one generation run, aggregated per stage
+
+    Wrap each pipeline stage in `with report.stage(name):` and record
+    per-letter build times with record_letter(). With track_memory the
+    report also traces Python allocations (via tracemalloc) for each stage,
+    which slows the run down, so it is opt-in. Tracing is process-wide, so
+    while another report is tracking memory this one records time only
+    (to_dict() says so in 'memory_tracked'). Peaks are only reported for
+    outermost stages, since a nested stage would reset its parent's peak.
+    """
+
+    enabled = True
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.stages = {}
+        self.letter_seconds = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+        self.finished = None
+        self.memory_requested = track_memory
+        self.memory_tracked = track_memory
+        self._started_tracing = False
+        self._depth = 0
+        if track_memory:
+            if _memory_tracking.acquire(blocking=False):
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self._started_tracing = True
+            else:
+                self.track_memory = False
+                self.memory_tracked = False
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block and add it to the named stage's totals"""
+        track_memory = self.track_memory
+        outermost = self._depth == 0
+        if track_memory:
+            if outermost:
+                tracemalloc.reset_peak()
+            allocated_before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            elapsed = time.perf_counter() - started
+            totals = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            totals['calls'] += 1
+            totals['seconds'] += elapsed
+            if track_memory and self.track_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                totals['bytes_allocated'] = totals.get('bytes_allocated', 0) + max(0, current - allocated_before)
+                if outermost:
+                    totals['peak_bytes'] = max(totals.get('peak_bytes', 0), peak - allocated_before)
+
+    def add_stage(self, name, seconds):
+        """Add a stage that was timed before this report existed"""
+        totals = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+        totals['calls'] += 1
+        totals['seconds'] += seconds
+
+    def record_letter(self, letter_format, seconds):
+        """Record how long one letter took to build in the given format"""
+        self.letter_seconds.setdefault(letter_format, []).append(seconds)
+
+    def count(self, name, amount=1):
+        """Add to a named counter, such as cache hits"""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def finish(self):
+        """Stop memory tracing if this report started it; later stages record time only"""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        if self.track_memory:
+            _memory_tracking.release()
+            self.track_memory = False
+        if self.finished is None:
+            self.finished = time.perf_counter()
+
+    def to_dict(self):
+        """Return the report as plain data, with per-letter latency percentiles"""
+        letters = {}
+        for letter_format, samples in self.letter_seconds.items():
+            ordered = sorted(samples)
+            letters[letter_format] = {
+                'count': len(ordered),
+                'total_seconds': sum(ordered),
+                'p50_ms': ordered[len(ordered) // 2] * 1000,
+                'p90_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))] * 1000,
+                'max_ms': ordered[-1] * 1000,
+            }
+        return {
+            'generation_seconds': (self.finished or time.perf_counter()) - self.started,
+            'stages': self.stages,
+            'letters': letters,
+            'counters': self.counters,
+            'memory_tracked': self.memory_tracked,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+class NullReport:
+    """Stand-in used when instrumentation is off; every call is a no-op"""
+
+    enabled = False
+    _null_stage = nullcontext()
+
+    def stage(self, name):
+        return self._null_stage
+
+    def add_stage(self, name, seconds):
+        pass
+
+    def record_letter(self, letter_format, seconds):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+    def finish(self):
+        pass
+
+NULL_REPORT = NullReport()
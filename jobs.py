@@ -0,0 +1,441 @@
+"""Run letter generation as background jobs, outside Streamlit's script reruns.
+
+Jobs are queued on a small thread pool in the server process, so a rerun or a
+closed tab doesn't stop them and several staff members can generate at once.
+Each job copies its upload into its own directory under the job store, renders
+its letters (across worker processes if asked) into the letter cache and writes
+the merged DOCX there, keeping its status and progress in job.json. ZIP archives
+are only built when someone asks for one, from the job's copy of the upload,
+and stay in the job directory so they can be downloaded later by job ID,
+including after a restart.
+"""
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from artifact_store import write_file_atomic
+from incremental import IncrementalBuild, DEFAULT_INCREMENTAL_DIR
+from ingestion import count_rows, iter_mp_frames
+from instrumentation import RunReport, NULL_REPORT
+from letter_generator import (
+    iter_letters, create_merged_docx, create_zip_file, letter_cache, template_version, ARCHIVE_FORMATS
+)
+
+# Job directories shared by every session of the app, next to this module
+DEFAULT_JOB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs')
+
+# Jobs run at the same time; later ones wait in the queue
+JOB_WORKERS = 2
+
+# Finished jobs older than this (in seconds) are deleted
+JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+# Finished jobs kept in memory with their performance report and letter list
+JOB_RESULTS_IN_MEMORY = 4
+
+# Progress is written to job.json at most this often (in seconds)
+PROGRESS_SAVE_SECONDS = 1.0
+
+JOB_FILE = 'job.json'
+
+# Each letter's MP data and file name, so letters can be rendered again on demand
+LETTERS_FILE = 'letters.json'
+
+INCREMENTAL_CHANGED_ERROR = (
+    "The incremental letters have been regenerated by a later job since this one ran; generate the letters again"
+)
+
+TEMPLATE_CHANGED_ERROR = "The letter template has changed since this job ran; generate the letters again"
+
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{12}')
+
+# Job statuses; a job ends as 'done' or 'failed'
+QUEUED, RUNNING, PACKAGING, DONE, FAILED = 'queued', 'running', 'packaging', 'done', 'failed'
+FINISHED_STATUSES = (DONE, FAILED)
+
+# Download file name of each archive type
+ARCHIVE_FILENAMES = {
+    'docx': 'mp_care_index_letters_docx.zip',
+    'html': 'mp_care_index_letters_html.zip',
+    'pdf': 'mp_care_index_letters_pdf.zip',
+    'both': 'mp_care_index_letters_all.zip',
+    'all': 'mp_care_index_letters_all.zip',
+}
+
+# Download file name of the single merged DOCX
+MERGED_FILENAME = 'mp_care_index_letters_merged.docx'
+
+class Job:
+    """One generation run: its options and progress, and its letters once finished
+
+    `state` is what job.json holds. The letter bytes only live in the job's
+    archives; letters() lists each MP so single letters can be rendered (or
+    fetched from the letter cache) when someone asks for them. `report` only
+    exists in the process that ran the job, until the runner releases it.
+    """
+
+    def __init__(self, job_dir, state):
+        self.job_dir = job_dir
+        self.state = state
+        self.report = NULL_REPORT
+        self._letters = None
+        self.lock = threading.Lock()
+        # Archives are built one at a time per job, so they can share its report
+        self.build_lock = threading.Lock()
+        self._saved = 0.0
+
+    @property
+    def job_id(self):
+        return self.state['job_id']
+
+    @property
+    def status(self):
+        return self.state['status']
+
+    @property
+    def input_path(self):
+        return os.path.join(self.job_dir, self.state['input_file'])
+
+    @property
+    def archive_types(self):
+        """Archive types offered for the job's letters"""
+        return ('docx', 'html', 'pdf', 'all') if self.state['options']['pdf'] else ('docx', 'html', 'both')
+
+    def template_changed(self):
+        """Check whether the letter template or logo changed since the job rendered its letters
+
+        Single letters and archives are rendered again on request, so once
+        this is true they would no longer match the job's other letters.
+        """
+        return self.state.get('template_version') != template_version()
+
+    def archive_path(self, format_type):
+        return os.path.join(self.job_dir, f"{format_type}.zip")
+
+    @property
+    def merged_path(self):
+        return os.path.join(self.job_dir, 'merged.docx')
+
+    def save(self):
+        # Written under the lock, so an older snapshot can't replace a newer one on disk
+        with self.lock:
+            data = json.dumps(self.state, ensure_ascii=False, indent=1).encode('utf-8')
+            write_file_atomic(os.path.join(self.job_dir, JOB_FILE), data)
+            self._saved = time.monotonic()
+
+    def update(self, **changes):
+        """Change the job's state and save it"""
+        with self.lock:
+            self.state.update(changes)
+        self.save()
+
+    def advance(self, rows=1):
+        """Count rows as done, saving the progress now and then"""
+        with self.lock:
+            self.state['rows_done'] += rows
+            due = time.monotonic() - self._saved >= PROGRESS_SAVE_SECONDS
+        if due:
+            self.save()
+
+    def track(self, letters):
+        """Pass letters through while counting them as done"""
+        for letter in letters:
+            self.advance()
+            yield letter
+
+    def progress(self):
+        """Return a snapshot of the job's state with the estimated seconds left as 'eta_seconds'"""
+        with self.lock:
+            progress = dict(self.state)
+        progress['eta_seconds'] = None
+        rows_done, rows_total = progress['rows_done'], progress['rows_total']
+        if progress['status'] == RUNNING and rows_done and rows_total:
+            rate = rows_done / max(time.time() - progress['started'], 1e-6)
+            progress['eta_seconds'] = max(0.0, (rows_total - rows_done) / rate)
+        return progress
+
+    def read_archive(self, format_type):
+        """Return the bytes of one of the job's finished archives"""
+        with open(self.archive_path(format_type), 'rb') as archive_file:
+            return archive_file.read()
+
+    def letters(self):
+        """Return {mp_key: {'mp_data': ..., 'base_filename': ...}} for the job's letters, in CSV order"""
+        if self._letters is None:
+            try:
+                with open(os.path.join(self.job_dir, LETTERS_FILE), encoding='utf-8') as letters_file:
+                    self._letters = json.load(letters_file)
+            except OSError:
+                return {}
+        return self._letters
+
+    def save_letters(self, letters):
+        self._letters = letters
+        data = json.dumps(letters, ensure_ascii=False).encode('utf-8')
+        write_file_atomic(os.path.join(self.job_dir, LETTERS_FILE), data)
+
+    def read_merged(self):
+        """Return the bytes of the job's merged DOCX"""
+        with open(self.merged_path, 'rb') as merged_file:
+            return merged_file.read()
+
+    def release(self):
+        """Drop what the job holds in memory; its files stay on disk"""
+        self.report = NULL_REPORT
+        self._letters = None
+
+def _same_letters(manifest_letters, job_letters):
+    """Check an incremental manifest still holds exactly the letters a job generated"""
+    if list(manifest_letters) != list(job_letters):
+        return False
+    return all(
+        entry['mp_data'] == job_letters[mp_key]['mp_data'] and entry['base_filename'] == job_letters[mp_key]['base_filename']
+        for mp_key, entry in manifest_letters.items()
+    )
+
+class JobRunner:
+    """Queue of generation jobs run on a thread pool, with their files in `root`
+
+    Safe to share between Streamlit sessions. Jobs found on disk that this
+    process isn't running were interrupted by a restart and are marked failed.
+    """
+
+    def __init__(self, root=DEFAULT_JOB_DIR, max_jobs=JOB_WORKERS):
+        self.root = root
+        self.max_jobs = max_jobs
+        self.executor = None
+        self.jobs = {}
+        self.finished = []
+        self.lock = threading.Lock()
+
+    def submit(self, source, name, rows_total=None, workers=1, incremental=False, pdf=False,
+               collect_metrics=False, track_memory=False, check_seconds=0.0):
+        """Queue a job for an uploaded file (or path) and return its ID
+
+        `check_seconds` is the time already spent validating the file, added to
+        the job's performance report.
+        """
+        self.purge()
+        job_id = uuid.uuid4().hex[:12]
+        job_dir = os.path.join(self.root, job_id)
+        os.makedirs(job_dir)
+
+        # Keep a copy of the upload so the job doesn't depend on the session
+        input_file = f"input{os.path.splitext(name)[1].lower() or '.csv'}"
+        if isinstance(source, (str, os.PathLike)):
+            shutil.copyfile(source, os.path.join(job_dir, input_file))
+        else:
+            source.seek(0)
+            write_file_atomic(os.path.join(job_dir, input_file), source.read())
+
+        job = Job(job_dir, {
+            'job_id': job_id,
+            'status': QUEUED,
+            'source_name': os.path.basename(name),
+            'input_file': input_file,
+            'options': {
+                'workers': workers,
+                'incremental': incremental,
+                'pdf': pdf,
+                'collect_metrics': collect_metrics,
+                'track_memory': track_memory,
+                'check_seconds': check_seconds,
+            },
+            'rows_total': rows_total if rows_total is not None else count_rows(os.path.join(job_dir, input_file)),
+            'rows_done': 0,
+            'letters': None,
+            'changes': None,
+            'archives': [],
+            'building': [],
+            'archive_errors': {},
+            'merged': False,
+            'template_version': None,
+            'error': None,
+            'created': time.time(),
+            'started': None,
+            'finished': None,
+        })
+        job.save()
+
+        with self.lock:
+            self.jobs[job_id] = job
+        self._submit(self._run, job)
+        return job_id
+
+    def _submit(self, fn, *args):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix='letter-job')
+            self.executor.submit(fn, *args)
+
+    def build_archive(self, job, format_type):
+        """Queue building one of a finished job's archives, unless it is built or being built already"""
+        template_changed = job.template_changed()
+        with job.lock:
+            if job.status != DONE or format_type in job.state['archives'] or format_type in job.state['building']:
+                return
+            if template_changed:
+                job.state['archive_errors'][format_type] = TEMPLATE_CHANGED_ERROR
+                return
+            job.state['building'].append(format_type)
+            job.state['archive_errors'].pop(format_type, None)
+        job.save()
+        self._submit(self._build_archive, job, format_type)
+
+    def get(self, job_id):
+        """Return a job by ID from memory or the job store, or None if there is no such job"""
+        job_id = (job_id or '').strip().lower()
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            return job
+
+        job_dir = os.path.join(self.root, job_id)
+        try:
+            with open(os.path.join(job_dir, JOB_FILE), encoding='utf-8') as job_file:
+                job = Job(job_dir, json.load(job_file))
+        except (OSError, ValueError):
+            return None
+        # Jobs saved before archives were built on request have theirs already
+        job.state.setdefault('building', [])
+        job.state.setdefault('archive_errors', {})
+        if job.status not in FINISHED_STATUSES:
+            job.update(status=FAILED, error="Interrupted by a server restart", finished=time.time())
+        elif job.state['building']:
+            job.update(building=[])
+
+        # Keep it in memory so every session shares one copy while archives are built
+        return self._retire(job)
+
+    def _run(self, job):
+        options = job.state['options']
+        job.update(status=RUNNING, started=time.time(), template_version=template_version())
+        report = RunReport(track_memory=options['track_memory']) if options['collect_metrics'] else NULL_REPORT
+        report.add_stage('file_check', options['check_seconds'])
+        letters = {}
+
+        try:
+            changes = None
+            mps_frames = iter_mp_frames(job.input_path, job.state['source_name'])
+            try:
+                if options['incremental']:
+                    formats = ('docx', 'html', 'pdf') if options['pdf'] else ('docx', 'html')
+                    build = IncrementalBuild(DEFAULT_INCREMENTAL_DIR, formats)
+                    # Other jobs share the directory, so its manifest is read back before they can change it
+                    with build.locked():
+                        changes = build.update(
+                            mps_frames, workers=options['workers'], cache=letter_cache, report=report,
+                            progress=job.advance
+                        )
+                        for mp_key, entry in build.letters.items():
+                            letters[mp_key] = {'mp_data': entry['mp_data'], 'base_filename': entry['base_filename']}
+                else:
+                    # Letters go to the letter cache, which archives and single downloads are read back from
+                    rendered = job.track(iter_letters(
+                        mps_frames, workers=options['workers'], cache=letter_cache, report=report
+                    ))
+                    for mp_key, mp_info in rendered:
+                        letters[mp_key] = {'mp_data': mp_info['mp_data'], 'base_filename': mp_info['base_filename']}
+
+                job.update(status=PACKAGING, changes=changes)
+                if letters:
+                    merged_file = create_merged_docx(
+                        (entry['mp_data'] for entry in letters.values()), output=job.merged_path, report=report
+                    )
+                    merged_file.close()
+            finally:
+                report.finish()
+
+            job.save_letters(letters)
+            job.report = report
+            job.update(status=DONE, letters=len(letters), changes=changes, merged=bool(letters), finished=time.time())
+        except Exception as e:
+            job.update(status=FAILED, error=str(e), finished=time.time())
+        finally:
+            self._retire(job)
+
+    def _build_archive(self, job, format_type):
+        """Build one archive, from the incremental directory for incremental jobs
+
+        Other jobs are rebuilt from the job's copy of its upload, taking DOCX
+        and HTML from the letter cache.
+        """
+        options = job.state['options']
+        # A unique name, so a second build of the same archive can't write into this one's file
+        partial_path = f"{job.archive_path(format_type)}.{uuid.uuid4().hex[:8]}.partial"
+        try:
+            # Archive stages (zip_build, zip_compress, zip_write) join the job's performance report
+            with job.build_lock, job.report.stage('zip_build'):
+                if job.template_changed():
+                    raise ValueError(TEMPLATE_CHANGED_ERROR)
+                if options['incremental']:
+                    formats = ('docx', 'html', 'pdf') if options['pdf'] else ('docx', 'html')
+                    build = IncrementalBuild(DEFAULT_INCREMENTAL_DIR, formats)
+                    # The directory stays locked until its files are archived, so no other job changes them midway
+                    with build.locked():
+                        build.letters = build.load_manifest()
+                        if not _same_letters(build.letters, job.letters()):
+                            raise ValueError(INCREMENTAL_CHANGED_ERROR)
+                        letters = build.iter_letters(ARCHIVE_FORMATS[format_type])
+                        create_zip_file(letters, format_type, output=partial_path, report=job.report).close()
+                else:
+                    letters = iter_letters(
+                        iter_mp_frames(job.input_path, job.state['source_name']),
+                        workers=options['workers'], cache=letter_cache, pdf='pdf' in ARCHIVE_FORMATS[format_type]
+                    )
+                    create_zip_file(letters, format_type, output=partial_path, report=job.report).close()
+            os.replace(partial_path, job.archive_path(format_type))
+            with job.lock:
+                job.state['archives'].append(format_type)
+        except Exception as e:
+            with job.lock:
+                job.state['archive_errors'][format_type] = str(e)
+        finally:
+            with job.lock:
+                if format_type in job.state['building']:
+                    job.state['building'].remove(format_type)
+            job.save()
+
+    def _retire(self, job):
+        """Move a finished job out of the running set, keeping only the latest ones in memory
+
+        Returns the copy kept in memory, which is an earlier one if another
+        session loaded the same job from disk first.
+        """
+        with self.lock:
+            job = self.jobs.setdefault(job.job_id, job)
+            if job in self.finished:
+                self.finished.remove(job)
+            self.finished.append(job)
+            while len(self.finished) > JOB_RESULTS_IN_MEMORY:
+                old_job = self.finished.pop(0)
+                old_job.release()
+                self.jobs.pop(old_job.job_id, None)
+        return job
+
+    def purge(self):
+        """Delete finished jobs older than JOB_RETENTION_SECONDS"""
+        if not os.path.isdir(self.root):
+            return
+        expired_before = time.time() - JOB_RETENTION_SECONDS
+        with self.lock:
+            active = set(self.jobs)
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or entry.name in active:
+                continue
+            try:
+                expired = os.stat(os.path.join(entry.path, JOB_FILE)).st_mtime < expired_before
+            except OSError:
+                expired = entry.stat().st_mtime < expired_before
+            if expired:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+# Process-wide runner used by the Streamlit app across reruns and sessions
+job_runner = JobRunner()
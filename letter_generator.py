@@ -0,0 +1,884 @@
+# pandas, python-docx and multiprocessing are imported inside the functions that
+# need them so importing this module (and starting the app or CLI) stays fast
+import io
+import os
+import html
+import tempfile
+import threading
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from contextlib import ExitStack
+from itertools import islice
+import zipfile
+import re
+
+from artifact_store import ArtifactStore
+from instrumentation import NULL_REPORT
+from letter_template import load_letter_template
+from zip_writer import RawZipWriter, compress_entry
+
+# Date printed at the top of every letter
+LETTER_DATE = "4 September 2025"
+
+# CSV columns and the mp_data field each one becomes
+MP_COLUMNS = {
+    'full_salutation': 'full_salutation',
+    'salutation': 'salutation',
+    'First name': 'first_name',
+    'Last name': 'last_name',
+    'State/Electorate': 'electorate',
+    'percentage_electorate': 'percentage_electorate',
+}
+
+# Columns an MP CSV must contain
+REQUIRED_COLUMNS = list(MP_COLUMNS)
+
+# Characters stripped from names before they are used in filenames
+FILENAME_UNSAFE_PATTERN = r'[<>:"/\\|?*]'
+
+# Bump whenever the letter layout code changes so cached letters are not reused;
+# changes to the template file are picked up from its hash
+TEMPLATE_VERSION = "care-index-2025-v3"
+
+# Header logo, resolved next to this module so the working directory doesn't matter
+LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'violet_logo.png')
+
+# Rows handed to each pool worker at a time in parallel mode
+DEFAULT_CHUNKSIZE = 8
+
+# ZIP archives are kept in memory up to this size, then spill to a temp file
+ZIP_SPOOL_MAX_SIZE = 32 * 1024 * 1024
+
+# Total size of rendered letters kept by the in-process letter cache
+LETTER_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+_logo_cache = {}
+
+def _logo_mtime(path=LOGO_PATH):
+    """Return the logo's modification time, or None if the file is missing"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def load_logo(path=LOGO_PATH):
+    """Return the logo bytes, re-reading the file only when its mtime changes"""
+    mtime = _logo_mtime(path)
+    cached = _logo_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as logo_file:
+            cached = (mtime, logo_file.read())
+        _logo_cache[path] = cached
+    return cached[1]
+
+def copy_docx_template():
+    """Create a new document with Roboto font style and logo header"""
+    from docx import Document
+    from docx.shared import Inches, Pt
+    
+    doc = Document()
+    
+    # Set default font to Roboto 9pt for the entire document
+    try:
+        style = doc.styles['Normal']
+        style.font.name = 'Roboto'
+        style.font.size = Pt(9)  # 9pt font size
+    except:
+        # Fallback if font setting fails
+        pass
+    
+    # Add logo to header
+    try:
+        from docx.enum.text import WD_ALIGN_PARAGRAPH
+        
+        section = doc.sections[0]
+        header = section.header
+        header_para = header.paragraphs[0]
+        header_para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+        
+        # Add logo image to header
+        run = header_para.runs[0] if header_para.runs else header_para.add_run()
+        run.add_picture(io.BytesIO(load_logo()), width=Inches(1.25))
+    except Exception as e:
+        # Fallback if logo fails to load
+        print(f"Logo loading failed: {e}")
+        pass
+    
+    return doc
+
+def get_percentage_text(mp_data):
+    """Return the bolded constituent share used in the first bullet point"""
+    percentage = mp_data.get('percentage_electorate', '').strip()
+    if percentage and percentage != 'nan':
+        return f"{percentage} of your constituents"
+    return "Many of your constituents"
+
+# Block roles set in bold throughout, and the footer's size in the DOCX letter
+DOCX_BOLD_ROLES = {'date', 'salutation', 'heading', 'signature', 'signature-name'}
+DOCX_FOOTER_SIZE_PT = 8
+
+# Empty paragraphs added around blocks in the DOCX letter, where the HTML uses CSS margins
+DOCX_BLANK_LINES_BEFORE = {'signature-name': 3, 'footer': 3}
+DOCX_BLANK_LINES_AFTER = {'list': 1}
+
+def build_letter_skeleton(template):
+    """Build the styled letter from a parsed template, with {{slot}} markers where per-MP text goes"""
+    from docx.shared import Pt
+    
+    doc = copy_docx_template()
+    
+    for block in template.blocks:
+        for _ in range(DOCX_BLANK_LINES_BEFORE.get(block.role, 0)):
+            doc.add_paragraph()
+        
+        for item in block.items:
+            paragraph = doc.add_paragraph()
+            if block.role == 'list':
+                paragraph.style = 'List Bullet'
+            
+            # Each slot is a run of its own, so it serializes as a bare <w:t>{{slot}}</w:t>
+            for run in item:
+                docx_run = paragraph.add_run(run.text)
+                if run.bold or block.role in DOCX_BOLD_ROLES:
+                    docx_run.bold = True
+                if run.italic or block.role == 'footer':
+                    docx_run.italic = True
+                if block.role == 'footer':
+                    docx_run.font.size = Pt(DOCX_FOOTER_SIZE_PT)
+        
+        for _ in range(DOCX_BLANK_LINES_AFTER.get(block.role, 0)):
+            doc.add_paragraph()
+    
+    # Add proper document footer
+    if template.footer_text:
+        footer = doc.sections[0].footer
+        footer.paragraphs[0].text = template.footer_text
+    
+    # Save to bytes
+    doc_buffer = io.BytesIO()
+    doc.save(doc_buffer)
+    
+    return doc_buffer.getvalue()
+
+def _run_text_xml(text):
+    """Serialize run text the way python-docx does: tabs and line breaks become elements"""
+    text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f]', '', text)
+    pieces = []
+    for line_index, line in enumerate(re.split(r'[\r\n]', text)):
+        if line_index:
+            pieces.append('<w:br/>')
+        for tab_index, segment in enumerate(line.split('\t')):
+            if tab_index:
+                pieces.append('<w:tab/>')
+            if segment:
+                pieces.append(f'<w:t xml:space="preserve">{html.escape(segment, quote=False)}</w:t>')
+    return ''.join(pieces).encode('utf-8')
+
+class CompiledDocxTemplate:
+    """Serialized letter package with the variable slots located in word/document.xml
+    
+    Every part but word/document.xml (styles, theme, numbering, header, footer
+    and logo) is the same in every letter, so those parts are compressed once
+    here and copied into each package as they are.
+    """
+    
+    SLOT_PATTERN = re.compile(rb'<w:t>\{\{(\w+)\}\}</w:t>')
+    DOCUMENT_PART = 'word/document.xml'
+    
+    def __init__(self, package_bytes):
+        with zipfile.ZipFile(io.BytesIO(package_bytes)) as package:
+            self.parts = [(info.filename, package.read(info)) for info in package.infolist()]
+        
+        # None marks where the per-letter document part goes
+        self.entries = [
+            None if name == self.DOCUMENT_PART else compress_entry(name, data) for name, data in self.parts
+        ]
+        
+        # Split document.xml into static byte chunks around each slot marker
+        pieces = self.SLOT_PATTERN.split(dict(self.parts)[self.DOCUMENT_PART])
+        self.chunks = pieces[0::2]
+        self.slots = [name.decode('ascii') for name in pieces[1::2]]
+    
+    def render_document_xml(self, values):
+        """Fill the slots and return the bytes of word/document.xml"""
+        pieces = [self.chunks[0]]
+        for slot, chunk in zip(self.slots, self.chunks[1:]):
+            pieces.append(_run_text_xml(values[slot]))
+            pieces.append(chunk)
+        return b''.join(pieces)
+    
+    def render(self, values):
+        """Fill the slots and return the bytes of a complete DOCX package
+        
+        Only word/document.xml is compressed; the other parts are spliced in
+        from the entries compressed when the template was compiled.
+        """
+        document_entry = compress_entry(self.DOCUMENT_PART, self.render_document_xml(values))
+        doc_buffer = io.BytesIO()
+        with RawZipWriter(doc_buffer) as package:
+            for entry in self.entries:
+                package.write_entry(entry or document_entry)
+        return doc_buffer.getvalue()
+    
+    # Paragraph that ends a letter's section in the merged document; it is kept to a
+    # hairline so it can't push a full-page letter onto a second page
+    SECTION_BREAK_PARAGRAPH = (
+        b'<w:p><w:pPr><w:spacing w:before="0" w:after="0" w:line="20" w:lineRule="exact"/>'
+        b'<w:rPr><w:sz w:val="2"/></w:rPr>%s</w:pPr></w:p>'
+    )
+    
+    def _merge_plan(self):
+        """Return the document head and tail around the body, and the paragraph that ends each letter's section"""
+        head_end = self.chunks[0].index(b'<w:body>') + len(b'<w:body>')
+        last_chunk = self.chunks[-1]
+        sect_start = last_chunk.rindex(b'<w:sectPr')
+        sect_end = last_chunk.rindex(b'</w:sectPr>') + len(b'</w:sectPr>')
+        section_break = self.SECTION_BREAK_PARAGRAPH % last_chunk[sect_start:sect_end]
+        return self.chunks[0][:head_end], last_chunk[sect_start:], section_break
+    
+    def render_merged(self, values_list, output):
+        """Write one DOCX package to `output` with a section per set of slot values and return how many there were
+        
+        Every section uses the template's header, footer and styles, so those
+        parts and the logo image are stored once; each letter only adds its
+        body text to word/document.xml, which is streamed into the package.
+        """
+        head, tail, section_break = self._merge_plan()
+        count = 0
+        
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as package:
+            for name, data in self.parts:
+                if name != self.DOCUMENT_PART:
+                    package.writestr(name, data)
+                    continue
+                with package.open(name, 'w', force_zip64=True) as document_file:
+                    document_file.write(head)
+                    for values in values_list:
+                        document_xml = self.render_document_xml(values)
+                        # Close the previous letter's section so this one starts on a new page
+                        if count:
+                            document_file.write(section_break)
+                        document_file.write(document_xml[len(head):len(document_xml) - len(tail)])
+                        count += 1
+                    document_file.write(tail)
+        return count
+
+_compiled_docx_template = None
+
+def get_compiled_docx_template():
+    """Return the letter skeleton, rebuilding it only when the template or logo file changes"""
+    global _compiled_docx_template
+    template = load_letter_template()
+    key = (template.digest, _logo_mtime())
+    if _compiled_docx_template is None or _compiled_docx_template[0] != key:
+        # The compiled package holds the header XML and the embedded image part,
+        # so every letter reuses them instead of re-reading and re-hashing the PNG
+        _compiled_docx_template = (key, CompiledDocxTemplate(build_letter_skeleton(template)))
+    return _compiled_docx_template[1]
+
+def letter_slots(mp_data):
+    """Return the per-MP values for the template slots"""
+    return {
+        'date': LETTER_DATE,
+        'first_name': mp_data['first_name'],
+        'last_name': mp_data['last_name'],
+        'electorate': mp_data['electorate'],
+        'full_salutation': mp_data['full_salutation'],
+        'salutation': mp_data['salutation'],
+        'percentage_text': get_percentage_text(mp_data),
+    }
+
+def create_letter_from_template(mp_data):
+    """Create a letter for an MP using the template content and replacing placeholders"""
+    doc_bytes = get_compiled_docx_template().render(letter_slots(mp_data))
+    return io.BytesIO(doc_bytes)
+
+# HTML page around the letter body; the template's body replaces HTML_BODY_MARKER and the
+# result is compiled once into byte chunks by CompiledHtmlTemplate
+HTML_BODY_MARKER = "<!-- letter body -->"
+
+HTML_LETTER_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>MP Letter - {{first_name}} {{last_name}}</title>
+    <style>
+        body {
+            font-family: 'Roboto', Arial, sans-serif;
+            font-size: 10pt;
+            line-height: 1.4;
+            max-width: 800px;
+            margin: 0 auto;
+            padding: 20px;
+            color: #333;
+        }
+        .date {
+            font-weight: bold;
+            margin-bottom: 20px;
+        }
+        .address {
+            margin: 20px 0;
+        }
+        .salutation {
+            font-weight: bold;
+            margin: 15px 0;
+        }
+        .section-heading {
+            font-weight: bold;
+            margin: 15px 0 10px 0;
+        }
+        ul {
+            margin: 15px 0;
+            padding-left: 20px;
+        }
+        li {
+            margin-bottom: 10px;
+        }
+        .signature {
+            font-weight: bold;
+            margin-top: 30px;
+        }
+        .signature-name {
+            font-weight: bold;
+            margin-top: 60px;
+        }
+        .footer {
+            margin-top: 60px;
+            font-style: italic;
+        }
+        .header-logo {
+            float: right;
+            width: 150px;
+            height: auto;
+            margin-bottom: 20px;
+        }
+        .clear {
+            clear: both;
+        }
+    </style>
+</head>
+<body>
+    <div class="header-logo">
+        <img src="data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAR0AAABoCAYAAADM8iS9AAARs0lEQVR42u2debxWRRnHv6yXy2VxgRQEURRDQXErFHBBQQmFLMrcyCVSQzHTMi0zl9wKCtdwLbVwTS0NRdyyUDBc0CQwyg3FNERAglC5/fE89+P19i4zc86c97y+z/fzOR8u75k5Z86cM7/ZnnmmVWNjI4ZhGFnR2rLAMAwTHcMwTHQMwzBMdAzDMNExDMMw0TEMw0THMAwTHcMwDBMdwzBMdAzDMEx0DMOoDtrGuOjZh8yp9XzdAxgMbK3C/grwDDAL+Mg+uyB2BUYCfwfutOzIjvNu3y3/olPjDAWOUNHZQkVnCbAd0BG4y7LIi87AEGCUis7DJjrW0jE+Lhy/BMYVOLedHkcA84DjteVjFG/V7A0MA4YDXZqde8eyx0THgK7As8CWjgXqaa29n7SsA8233VVg9gH6lgi7zLLLRMeABxwFpzmPAhsDq2swvzoBn9fu0nDtihomOoYjBwAhI211wA+BM2osv4YAf7Rvr3axKfPknJAg7rgazK9/muCY6BjJGJAgbl+gW43l11vAz+yzMdExwmmfMP8712Ce/dw+GxMdI5x/J4i7AryjBvNsCWIoaZjoGAHclyDuPGBdjebbhfbpmOgY2XcVzqvhfHsMWdJgmOgYniwDDgmIdwXweI3n3U/s8zHRMcK4AxgP/Ncx/GRgkmVboq6pYaJT8/wa2Aq4FFhc4PxSYDtiHPddyy4A2lkW1B5mpJUubwCn6LEN0BtoBfwLeBFYb1lk319GdATaAKvspdcOL+lhGFmyg3b1jwWeAr5gomMYRgz2Bk4GvtTst1xau5voGEZ1szPwI2BsgXOr8phgEx3DqE7qkVnQidWWcBMdw6g+DgSuBnpWY+JtytwwqoupwL3VKjjW0nGjDnejP8OIxYbA75CdRqoaE53/pxviOnMfxCtgN2BH0lkN3hbYBdgf6AecCKzMsFW7mT7PBohLjTZ6bq2mYxlixLjCPgNAHMI35VkXPnZj8h/gPcT+6jXi219thSyZ6ZnhtzIGmQl7ArimGkTnQMRBVdIV1K2AD4DrImfwLsB+iL/eYdq6ac5JwJmB199CBazp6NHs3I8jik5nfZa9kBmOgS3uXYzViEX108Bc4CHE61+tiMwIYF+taPoj/pxLsRRxyv9nYAYwP+U0DdT30DGD598esfE5DOilv6XuCD+W6AwDvpfStf4bQXT68PE+SkMcCuNoD9HpgthM7KsiM7BE2BhuLQ4EvqUtqC4B8RuAQXocq7/NRZZ53EhOp2ETshcwAfgi/k7VeugxGnHX8QwyyJtG66Cfin/7iM++IXCois3uLc6tBGZWi+icgezzNCaFa50TSdGneYTfVj/GVUVaY4O1pbSn1pCV8AY4AVlEukOEaw/W4zzgWm2hfRrEZ2/EOf4+KV5zZxWd0/Xb/XXgdbqq2McSnFFaOY0p0Zp7Xo/UuxaxODGl69wSIW33AS94hG+nTe2WTAZeR/avOldbN1kLznDEGdi1kQSnZa14una3vl7FYtOg+fVoyoLTchzmZmQ30pCu0eOa32mW7wHA+cAi4H7tRpXqPj6F+LSuGtF5HdnxMgl/AV6NlD5fz3WbFanVNqtg4fkp8AgyJlWKG5FBwf7IGNPOiFFZaNO5m3Z573YY88gbwxDnYRPKhFuEWPoORfY064vMHJ3tWWGNAxYAn/WIc01KFci7QAfgSGRs7q/AWchiZBdejPECYs9enQYck7NWThP3AO97FJqGAr9N0heZNfXIBn97lgk3T/vqC1v8/ioy+PkLLVRTkZ1HfTlIP8wRVIcXwPHATQ7hzgIuKPD7y8iA8fnI1tCuXfQ+yADzIBWzUowGvpPS8+6GzK51D4y/MMZLiG0cuByYkiD+rRHTthZ40CN8qyI1weyMC05X7WeXE5zZwOccPpymcJcHpmdzTc92ORackxwFZ0wRwWnJ1cBOuE8G1OkYTanB/TYpf/M9EgjOWs8WXW5EB2Sg7oOAeLOQ6ciYPO0R9v0iv1+cYcFpA8wBti4TbqW2Pnw4GfhBYLo6aIHqlVPBOcJRVI/Hz5vhc8iYmk+FUaqim0J+tiSaT6TJgixEZ40Kjy8zMkibT591SZHf70OMxLLgYQoPaBcqPGsDrn+hYy1fiE7a9cgbO+E2g/QwYdPcTyDjPK4MprD5xcbAt1J+9hXIFP5C4BX9Tpcjxo3lDBqjbY2UlUXyZGSa1ed+o3WsISaLHcOto7RDrsv1+WJyPmJP4vJMSZroZyEmBWMD4vYBfqMtodzQGhlAdeHohO9mIrCph7hfD7zd7LdViAV8+xLds+vwG7ifi9hrNW8p1+lRr/eqR8YrG7Tr11FbZPOqXXQ+0oJwpEeckdqNWBwxXcuBxiLjNS0LcinL4WnaNamPlM7tVAxcuDqF+x2EbCK4UUDcw4EbtOVQaW5wfIY7SrRkXbkI8Y/tyiV8cpJlnUPr/gpP0WlToBz+R4/llawJsiJkoPKEyGlq1KMcz5Q5vwyxe4iFj4HZrSnly1cSxL+JyjMIOMox7GUp3O9G/CzMj8ZvkLdjARHJU/nOZaKeAv7hGecYh1ZIEhoc88BlcDHWIsn9dVzChb+lUGM38QiyqjmEnh4FPhbXOoZ7l3RmIFfgv1XyUdQgWSvhNM/wG2k/NxabO4ZzacXURUrjRR5hn0553klampXcvXQYYgbgwkzH1q4Lj3mGP9pEJz43Brzgb0VMT3/Hj3Jlhd7Prh6tHJAp3DR5K0FXaXM+OYiZJT6zpWkK9Z88ww+gshbtNSE67+A/FT7Co0Xii4tB25UVfD/Heob/e4ULcEsqsT5rE2TxrStpTlQ8j5iI+LAXNUYlBpquCIgzIVJaPu/Q37+3gu/Hd9p6WYQ0vBbQbWhiP7LfxdN3AHxJivdeg4yr+bB7rYlOJTwHPoBMx/rsyTMBPwMs1xqx3Hqjqyr4bnYKaHrH6gZeiriB8KUrslwjy+lzny7dh2W6Vx306KrHBoitSyfEcriz/t2p2W+9PdPbz0QnG64Bvu8RvgfiNiLNj3dfys+MTfW4XshgZKn7Dw6saWMwA/Eo2BDYmsxKdOrwW5awXlve9cikxYYqHg0tjrqIae5JjVEp0bnCU3RABpTT/HgPKnN+umd3xdfZUqPWtMUYFPBMsXz1rkOmzw8PiLt9ht/V9p7C2J70/D6F0rXWRKdSxkNLEQdKPoxJ8QXVOYjOOZEFfD2lF8LukLP3GSr4AzP8rrapwjLYMXJLykSnGSGzQmnNhoyl9ADnTPxngtLuXoVMpdZHfF+zAuP1zrBQbVmFZbAbNbYrSyUf9rfIIjefpfzHAz9L4d7fLHP+OxV+L52QQUtfukRM0+sqxP0C0tSddGeJitEnIM5ETVu9HnXaReug/++oFVTTubZ6tNF/W2s3rWlJTfsSlfkHyPqn1s3+foF4Y3EmOgW4AT/jv22QgcmnEtxzU0oPNs6kMt4Am9OZML8qG0VO15MBotOasAHoED4TEOcx/Ke5jSrtXoG4y0y7lVKOk8ucPzEH76VN4LvpEzldoda7HTLKtxBx28NkoLZEZ1HAh3x4wo+4lKhMx39Rap6IPWj7cs6/s5D79DMZqC3RAX8DvPaEL5Q7ssy4xyk5eS+hCxA/Gzldod7k1mWUbyH3GWwyUHuic0vAxzIx8F6lHGFNQdaG5YEmR0t5a+mE5k9WA6UhPn2HEncA3sih6KxBVp/7sD3+Rmd7lGgJrEF2Jc0LKwjzz9ONMKNCV95DLJN9WIusYcuCpYFlYLhJQW2JDoTZ7Pj6einl3+VUSlsHZ836BK2KERHTtRr/9V1vq1hlQejGjMd+Sst3Yx4TlRfRmY/sgujDUbivYO5P8QWL/8TfuVgWhE7j7hMxTesDWjoLMsyz1wLjjSVsut2oYtEB/+nzBmSrXBdKbatyZE7fzfzAeCOJu57H133sCxnmWRJ7m3M+heW7Qx4TlSfRuTmgi3OKQ5gtgS8XOTcDMXjLI88FxmsHfDFSmtrgbwvzXIZ5tpDw8aNv4r6FTLWQywHyPInOCvwdge9Oea+CF1VpX342YTujNhWgGDQEtKKy9KXzUcL73Z7j76FVQCtzE3K4I0TeEhSyFUip6fNewFeLnDuX7HbmDGEl7hvFtWQ34qy43gi/RaWzK5DHDyWIuwdwek6/h3UBlVB3cuiDOW+i8zj+BmhHlzh3bpHf36mSPvxtCeKeGyE9vt2P6RXIsztI5lfoEpLt+eXDL3HbHAAVnPcD7rGLiU55fHeo3AT4QpFauVj36RtV0ie/hXDDukMjjFH4rO1ap4Uqa5YDf0h4jduB8ZHT+WetMN/0iBMyXjXGRKc81wfEObXAb8VaMnMI30SuEk3qqQniX5dyenxqzUupnMuGC1K4xk3ATyOkbRfEi8FQZPLEx+7pzYD7HZa3cp5H0XkT/8HAEXxyi9bOFF/YeSjVxcUJugsHkO4WJ6McwzUCP65gns3VlkRSvqMCkcZsYE9kzHIest8V+G0XDWFbDNUnEOEt8HfDW5WiAzA5IE5zC+XvF3m2ywi3WnUpaL64zEasJNngZlozMlvivvTkVCq3QWHaXegBwD3aQp7k2cXsihge3oys0J/U7Nzb+HtjDBXSM/DbC2wbxE5sOhFsffLqJvEB7Ztv6BHn68D5WpC/XeD86iLdsLTwtTHyse6dAhxH2IzUZ4BbU2jhHecY7nmPLmHIota1juEWahcvrR1iB+vR1Fp5FnhFxaMpTR2AjZEZowHI1sadS3QBfSuqRxOkfyZi13ZZifsORMZBm8rPt2NUHnn2zToNONMjfB/ExedICvvknYjYccTCdyuRVp61yChkyUYIX9VCckmCFvFJjq29UR7XDbGc3tgj7CnAgcBWKb/rXSm/Z1oplhNmHvIeYoYwNPC+U7XifRCxFF+FuGPdSq/ZfPPJDxDPntSS6FzjKTpojV7IWHAB4Xtyu7A1/h7o2mrrzLW//TKyg8U9gWm8WGutEG+NVyJ+m8sxEr+V3iHGmSOQWbm3HMPvhazJytNQwuEJ4k5NIDpo+XDZMXdarC5yXsd00KbrbM84+wPbFvj9iMhpDXVx6ms5/DuSWRtfhb990kG4regfh/8EQMi4S1v8/Cm9kbCQps2VOnwQyp1kY3B5dqwL51l0CKyVW3Izcdf/tCV8r/XN8NsGt6kGSrK3+48QO5a+DmHHA3c7hBsD3OWZjsMIdyR/nGf4OcAQsvNgWIyHHLup5TghcjonEdEdSd5F5zbCrDCb90snRk7jwY5dj2J8LyDO9chsxLLAe44GFmutuyefdBHSDnGPcYdDl3QB4jTsvoA0nJYgzzbBfxr7SWT2bUGFvuUHtfuZBvcA90ZK5wPIDrzRyLvofIhY5YZyWkLRciHpWp3hhO1nPQvxhHhr4H1bqSD/Ubsg87VFuES7SQeXiT8FmaF5PuDe/Ulunv/dgDgvaZqvyvg7vjygRVuOsREEdC6FrftrSnRApj1DeFVfdkx2BHZK4TqhTe5l2k05gGR7gXVHtjEeRHlnVr/X506yIWEa09hDHbuIhThR4z8e+ftYrC2ykyNdf1fgiZSudS+yULg61SA6LwYq+vgM0nZpStc5k7AdPZuYgdiQjNamd9puKt9Fxtd21kI0P8G1eqU4JvHzBHGfQGa29ouQZ4t0XKSfinQs1qh4JrH+fl9FcWxWBbpa9lA+ncIGf8V4DvhTBulaivuMTVsdLyn0cTdoYXwvYXru16M3MrU8SmtD3xbBhyosc/R6j+HvprQYPfS6q1PK/6TM0qO3CtBoxKivt+d15mvL6W6SGfGF8EPgV8jM5jhk+YJLGbkFscX5d5aJbdXYmL7v5rMPmYORK7ZFDMB6IcZ1GyBrctoh1rSrEYO1t5A9y18ibHHhp4XWiHXu1sgMY3fEsrgDYkm+ViuItxEboEWEG27GYIi+897IDGE7bRUtQ0xRXsBjLO6823fLv+gYhmGUUnTDMAwTHcMwTHQMwzBMdAzDMNExDMMw0TEMw0THMAwTHcMwDBMdwzBMdAzDMEx0DMMw0TEMwzDRMQzDRMcwDBMdwzAMEx3DMKqd/wGbzBpjFnSrxAAAAABJRU5ErkJggg==" alt="Violet Logo" style="width: 150px; height: auto;">
+    </div>
+    <div class="clear"></div>
+    
+<!-- letter body -->
+</body>
+</html>
+    """
+
+def _escape_html(text):
+    """Escape text for HTML text or attribute values, skipping the work when nothing needs escaping"""
+    if '&' in text or '<' in text or '>' in text or '"' in text or "'" in text:
+        return html.escape(text)
+    return text
+
+class CompiledHtmlTemplate:
+    """HTML letter split into pre-encoded byte chunks around its {{slot}} markers"""
+    
+    SLOT_PATTERN = re.compile(r'\{\{(\w+)\}\}')
+    
+    def __init__(self, template_text):
+        pieces = self.SLOT_PATTERN.split(template_text)
+        self.chunks = [chunk.encode('utf-8') for chunk in pieces[0::2]]
+        self.slots = pieces[1::2]
+        self.slot_chunks = list(zip(self.slots, self.chunks[1:]))
+    
+    def render(self, values):
+        """Fill the slots with HTML-escaped values and return the encoded letter"""
+        pieces = [self.chunks[0]]
+        for slot, chunk in self.slot_chunks:
+            pieces.append(_escape_html(values[slot]).encode('utf-8'))
+            pieces.append(chunk)
+        return b''.join(pieces)
+
+def html_letter_text(template):
+    """Return the full HTML letter for a parsed template, with its {{slot}} markers"""
+    return HTML_LETTER_TEMPLATE.replace(HTML_BODY_MARKER, template.html_body())
+
+_compiled_html_template = None
+
+def get_compiled_html_template():
+    """Return the compiled HTML letter, rebuilding it only when the template file changes"""
+    global _compiled_html_template
+    template = load_letter_template()
+    if _compiled_html_template is None or _compiled_html_template[0] != template.digest:
+        _compiled_html_template = (template.digest, CompiledHtmlTemplate(html_letter_text(template)))
+    return _compiled_html_template[1]
+
+def create_html_letter(mp_data):
+    """Create an HTML version of the letter"""
+    html_bytes = get_compiled_html_template().render(letter_slots(mp_data))
+    return io.BytesIO(html_bytes)
+
+def render_html_letters(mps_df):
+    """Render the HTML letter for every MP in the DataFrame
+    
+    Returns a list of encoded letters in the same order as
+    collect_mp_records(mps_df), without a buffer object per letter.
+    """
+    render = get_compiled_html_template().render
+    return [render(letter_slots(mp_data)) for mp_key, mp_data, base_filename in collect_mp_records(mps_df)]
+
+_pdf_renderer = None
+
+def get_pdf_renderer():
+    """Return the PDF renderer for the HTML letter, rebuilding it only when the template or logo file changes"""
+    global _pdf_renderer
+    template = load_letter_template()
+    key = (template.digest, _logo_mtime())
+    if _pdf_renderer is None or _pdf_renderer[0] != key:
+        from pdf_renderer import PdfLetterRenderer
+        _pdf_renderer = (key, PdfLetterRenderer(html_letter_text(template), load_logo()))
+    return _pdf_renderer[1]
+
+def create_pdf_letter(mp_data):
+    """Create a PDF letter from the HTML template"""
+    return io.BytesIO(get_pdf_renderer().render(letter_slots(mp_data)))
+
+def render_pdf_batch(mp_datas):
+    """Render PDF bytes for several MPs with one renderer, returning (pdf_bytes, seconds) pairs
+    
+    Runs inside pool workers in parallel mode, so each worker renders a whole
+    chunk of letters per task.
+    """
+    renderer = get_pdf_renderer()
+    rendered = []
+    for mp_data in mp_datas:
+        started = time.perf_counter()
+        pdf_bytes = renderer.render(letter_slots(mp_data))
+        rendered.append((pdf_bytes, time.perf_counter() - started))
+    return rendered
+
+def get_letter_bytes(mp_data, letter_format, cache=None):
+    """Return one MP's letter as 'docx', 'html' or 'pdf' bytes, taking the DOCX and HTML from `cache` when it has them"""
+    if letter_format == 'pdf':
+        return get_pdf_renderer().render(letter_slots(mp_data))
+    
+    cache_key = letter_cache_key(mp_data)
+    letter = cache.get(cache_key) if cache is not None else None
+    if letter is None:
+        letter = render_letter_pair(mp_data)
+        if cache is not None:
+            cache.put(cache_key, letter)
+    return letter[0] if letter_format == 'docx' else letter[1]
+
+def render_letter_pair(mp_data):
+    """Render the DOCX and HTML bytes for one MP; runs inside pool workers in parallel mode"""
+    doc_bytes = get_compiled_docx_template().render(letter_slots(mp_data))
+    html_bytes = get_compiled_html_template().render(letter_slots(mp_data))
+    return doc_bytes, html_bytes
+
+def render_letter_pair_timed(mp_data):
+    """Like render_letter_pair, but also return the seconds spent on each format"""
+    started = time.perf_counter()
+    doc_bytes = get_compiled_docx_template().render(letter_slots(mp_data))
+    docx_done = time.perf_counter()
+    html_bytes = get_compiled_html_template().render(letter_slots(mp_data))
+    html_done = time.perf_counter()
+    return doc_bytes, html_bytes, docx_done - started, html_done - docx_done
+
+def _init_worker(pdf=False):
+    """Compile the letter templates once per worker process"""
+    get_compiled_docx_template()
+    if pdf:
+        get_pdf_renderer()
+
+def _pool_context():
+    """Pick a start method that is safe inside the threaded Streamlit server"""
+    import multiprocessing
+    
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+def find_missing_columns(columns):
+    """Return the required MP columns absent from `columns`, in the expected order"""
+    return [col for col in REQUIRED_COLUMNS if col not in columns]
+
+def normalize_mp_frame(mps_df):
+    """Clean the MP columns in one vectorized pass and add the MP key and filename columns"""
+    import pandas as pd
+    
+    normalized = pd.DataFrame(index=mps_df.index)
+    for column, field in MP_COLUMNS.items():
+        normalized[field] = mps_df[column].astype(str).str.strip()
+    
+    # Missing percentages (blank cells, or NaN from pandas) become ''
+    normalized['percentage_electorate'] = normalized['percentage_electorate'].where(mps_df['percentage_electorate'].notna(), '')
+    
+    # Create a unique key for each MP
+    normalized['mp_key'] = normalized['electorate'] + '_' + normalized['first_name'] + '_' + normalized['last_name']
+    
+    # Clean filename components
+    electorate = normalized['electorate'].str.replace(FILENAME_UNSAFE_PATTERN, '', regex=True)
+    first_name = normalized['first_name'].str.replace(FILENAME_UNSAFE_PATTERN, '', regex=True)
+    last_name = normalized['last_name'].str.replace(FILENAME_UNSAFE_PATTERN, '', regex=True)
+    normalized['base_filename'] = electorate + ', ' + first_name + ' ' + last_name + ' - MP Letter'
+    
+    return normalized
+
+def collect_mp_records(mps_df):
+    """Return (mp_key, mp_data, base_filename) records in CSV order
+    
+    A repeated key keeps its first row; later rows for it are ignored.
+    """
+    normalized = normalize_mp_frame(mps_df)
+    fields = list(MP_COLUMNS.values())
+    mp_records = {}
+    
+    for row in normalized[fields + ['mp_key', 'base_filename']].itertuples(index=False, name=None):
+        mp_records.setdefault(row[-2], (row[-2], dict(zip(fields, row)), row[-1]))
+    
+    return list(mp_records.values())
+
+def template_version():
+    """Return a string that changes whenever rendered letters would change"""
+    return f"{TEMPLATE_VERSION}:{load_letter_template().digest}:{_logo_mtime()}"
+
+def letter_cache_key(mp_data, version=None):
+    """Return the content hash of an MP's normalized data and the template version"""
+    payload = json.dumps(mp_data, sort_keys=True, ensure_ascii=False)
+    payload += '\n' + (version if version is not None else template_version())
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class LetterCache:
+    """Bounded LRU cache of rendered (docx, html) bytes keyed by letter_cache_key
+    
+    Entries are evicted least recently used first once their total size passes
+    `max_bytes`. Safe to share between Streamlit sessions. With an
+    ArtifactStore as `store`, misses fall through to the store on disk and new
+    letters are written to it, so they survive restarts and are shared with
+    other processes.
+    """
+    
+    def __init__(self, max_bytes=LETTER_CACHE_MAX_BYTES, store=None):
+        self.max_bytes = max_bytes
+        self.store = store
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            letter = self.entries.get(key)
+            if letter is not None:
+                self.entries.move_to_end(key)
+                return letter
+        
+        if self.store is not None:
+            letter = self.store.get(key)
+            if letter is not None:
+                self._remember(key, letter)
+        return letter
+    
+    def put(self, key, letter):
+        self._remember(key, letter)
+        if self.store is not None:
+            self.store.put(key, letter)
+    
+    def _remember(self, key, letter):
+        """Keep a letter in memory, evicting the least recently used past max_bytes"""
+        size = sum(len(part) for part in letter)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= sum(len(part) for part in previous)
+            self.entries[key] = letter
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                evicted_key, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= sum(len(part) for part in evicted)
+    
+    def clear(self):
+        """Empty the in-memory cache (the store, if any, is left alone)"""
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+# Process-wide cache used by the Streamlit app across reruns and sessions,
+# backed by the on-disk store shared with other sessions and processes
+letter_cache = LetterCache(store=ArtifactStore())
+
+def iter_mp_records(mps_data, report=NULL_REPORT):
+    """Yield (mp_key, mp_data, base_filename) records from a DataFrame or an iterable of DataFrame batches
+    
+    Batches are read and normalized one at a time, so a streamed file never
+    has to be in memory at once. A repeated key keeps its first row, in the
+    same batch or an earlier one, so the result doesn't depend on batch size.
+    """
+    if hasattr(mps_data, 'columns'):
+        with report.stage('normalize'):
+            mp_records = collect_mp_records(mps_data)
+        yield from mp_records
+        return
+    
+    batches = iter(mps_data)
+    seen_keys = set()
+    while True:
+        with report.stage('file_read'):
+            mps_df = next(batches, None)
+        if mps_df is None:
+            return
+        with report.stage('normalize'):
+            mp_records = collect_mp_records(mps_df)
+        for record in mp_records:
+            if record[0] not in seen_keys:
+                seen_keys.add(record[0])
+                yield record
+
+def iter_letters(mps_data, workers=1, chunksize=DEFAULT_CHUNKSIZE, cache=None, report=NULL_REPORT, pdf=False):
+    """Yield (mp_key, mp_info) for each MP, rendering letters only as they are consumed
+    
+    `mps_data` is a DataFrame or an iterable of DataFrame batches, such as
+    ingestion.iter_mp_frames(). Rows are rendered a bounded window at a time
+    so finished letters never pile up ahead of the consumer. With workers > 1
+    each window is spread across a process pool in chunks of `chunksize`.
+    When a LetterCache is given, rows whose content hash is already cached
+    are not rendered again. With pdf=True each letter also gets a
+    'pdf_buffer', rendered in batches per worker. Stage timings and
+    per-letter build times go to `report`. Output keeps the CSV row order
+    either way.
+    """
+    mp_records = iter_mp_records(mps_data, report)
+    yield from iter_record_letters(
+        mp_records, workers=workers, chunksize=chunksize, cache=cache, report=report, pdf=pdf
+    )
+
+def iter_record_letters(mp_records, workers=1, chunksize=DEFAULT_CHUNKSIZE, cache=None, report=NULL_REPORT, pdf=False):
+    """Like iter_letters, for an iterable of (mp_key, mp_data, base_filename) records"""
+    version = template_version()
+    chunksize = max(1, chunksize)
+    window = max(1, workers) * chunksize * 2
+    render = render_letter_pair_timed if report.enabled else render_letter_pair
+    mp_records = iter(mp_records)
+    
+    with ExitStack() as stack:
+        executor = None
+        compiled = False
+        
+        def get_executor():
+            """Start the process pool the first time a window has work worth spreading"""
+            nonlocal executor
+            if executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+                with report.stage('pool_start'):
+                    executor = stack.enter_context(ProcessPoolExecutor(
+                        max_workers=workers, mp_context=_pool_context(),
+                        initializer=_init_worker, initargs=(pdf,)
+                    ))
+            return executor
+        
+        while True:
+            batch = list(islice(mp_records, window))
+            if not batch:
+                break
+            
+            # Look up cached letters by content hash
+            if cache is not None:
+                with report.stage('cache_lookup'):
+                    cache_keys = [letter_cache_key(mp_data, version) for mp_key, mp_data, base_filename in batch]
+                    letters = [cache.get(cache_key) for cache_key in cache_keys]
+            else:
+                letters = [None] * len(batch)
+            missing = [index for index, letter in enumerate(letters) if letter is None]
+            report.count('cache_hits', len(batch) - len(missing))
+            report.count('letters_rendered', len(missing))
+            
+            # Compile before the first render in serial mode so the first letter's time is just that letter
+            if workers <= 1 and missing and not compiled:
+                with report.stage('template_compile'):
+                    get_compiled_docx_template()
+                    get_compiled_html_template()
+                    if pdf:
+                        get_pdf_renderer()
+                compiled = True
+            
+            # Render the rest, across the pool if it is worth starting one
+            to_render = [batch[index][1] for index in missing]
+            if workers > 1 and len(to_render) > 1:
+                rendered = get_executor().map(render, to_render, chunksize=chunksize)
+            else:
+                rendered = map(render, to_render)
+            
+            with report.stage('render'):
+                for index, letter in zip(missing, rendered):
+                    if report.enabled:
+                        doc_bytes, html_bytes, docx_seconds, html_seconds = letter
+                        report.record_letter('docx', docx_seconds)
+                        report.record_letter('html', html_seconds)
+                        letter = (doc_bytes, html_bytes)
+                    letters[index] = letter
+                    if cache is not None:
+                        cache.put(cache_keys[index], letter)
+            
+            # PDFs are not cached, so they go to the pool even when every DOCX and HTML was a cache hit;
+            # each worker takes a whole chunk
+            pdf_letters = [None] * len(batch)
+            if pdf:
+                with report.stage('pdf_render'):
+                    mp_datas = [mp_data for mp_key, mp_data, base_filename in batch]
+                    chunks = [mp_datas[start:start + chunksize] for start in range(0, len(mp_datas), chunksize)]
+                    if workers > 1 and len(chunks) > 1:
+                        rendered_chunks = get_executor().map(render_pdf_batch, chunks)
+                    else:
+                        rendered_chunks = map(render_pdf_batch, chunks)
+                    pdf_letters = [pdf_bytes for rendered in rendered_chunks for pdf_bytes in rendered]
+                for pdf_bytes, pdf_seconds in pdf_letters:
+                    report.record_letter('pdf', pdf_seconds)
+            
+            for (mp_key, mp_data, base_filename), letter, pdf_letter in zip(batch, letters, pdf_letters):
+                mp_info = _letter_info(mp_data, base_filename, letter)
+                if pdf_letter is not None:
+                    mp_info['pdf_buffer'] = io.BytesIO(pdf_letter[0])
+                yield mp_key, mp_info
+
+def _letter_info(mp_data, base_filename, letter):
+    """Wrap rendered letter bytes in the buffers the UI and ZIP writer expect"""
+    doc_bytes, html_bytes = letter
+    return {
+        'doc_buffer': io.BytesIO(doc_bytes),
+        'html_buffer': io.BytesIO(html_bytes),
+        'mp_data': mp_data,
+        'base_filename': base_filename
+    }
+
+def process_mp_csv(mps_data, workers=1, chunksize=DEFAULT_CHUNKSIZE, cache=None, report=NULL_REPORT, pdf=False):
+    """Process the MP CSV and generate individual letters for each MP"""
+    return dict(iter_letters(mps_data, workers=workers, chunksize=chunksize, cache=cache, report=report, pdf=pdf))
+
+def letter_base_filename(mp_info):
+    """Return the archive filename (without extension) for an MP's letter"""
+    if 'base_filename' in mp_info:
+        return mp_info['base_filename']
+    
+    # Letters built outside normalize_mp_frame carry only their mp_data
+    mp_data = mp_info.get('mp_data', mp_info)
+    electorate = re.sub(FILENAME_UNSAFE_PATTERN, '', mp_data['electorate'])
+    first_name = re.sub(FILENAME_UNSAFE_PATTERN, '', mp_data['first_name'])
+    last_name = re.sub(FILENAME_UNSAFE_PATTERN, '', mp_data['last_name'])
+    return f"{electorate}, {first_name} {last_name} - MP Letter"
+
+# Letter formats contained in each archive type
+ARCHIVE_FORMATS = {
+    'docx': ('docx',),
+    'html': ('html',),
+    'pdf': ('pdf',),
+    'both': ('docx', 'html'),
+    'all': ('docx', 'html', 'pdf'),
+}
+
+def _open_archive_output(output):
+    """Return a writable binary file for an archive destination"""
+    if output is None:
+        return tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_SIZE)
+    if isinstance(output, (str, os.PathLike)):
+        return open(output, 'w+b')
+    return output
+
+def _discard_archive_output(output, archive_file):
+    """Close and delete an archive that failed partway, leaving caller-owned file objects open"""
+    if output is not None and not isinstance(output, (str, os.PathLike)):
+        return
+    archive_file.close()
+    if output is not None:
+        try:
+            os.remove(output)
+        except OSError:
+            pass
+
+def create_zip_files(mp_letters, format_types=('docx', 'html', 'both'), outputs=None, report=NULL_REPORT):
+    """Create several ZIP archives in one pass over the letters
+    
+    Each letter is compressed once and the same compressed entry is copied
+    into every archive that includes its format. `mp_letters` may be the dict
+    from process_mp_csv or any iterable of (mp_key, mp_info) pairs such as
+    iter_letters(), which is consumed one letter at a time. `outputs` maps a
+    format type to a path or binary file object; other archives go to a
+    spooled temporary file that moves to disk once it outgrows
+    ZIP_SPOOL_MAX_SIZE. Compression and writing time go to `report`.
+    Returns {format_type: open file rewound to the start}.
+    """
+    outputs = outputs or {}
+    zip_buffers = {format_type: _open_archive_output(outputs.get(format_type)) for format_type in format_types}
+    writers = {format_type: RawZipWriter(zip_buffer) for format_type, zip_buffer in zip_buffers.items()}
+    needed_formats = {letter_format for format_type in format_types for letter_format in ARCHIVE_FORMATS[format_type]}
+    
+    try:
+        letters = mp_letters.items() if isinstance(mp_letters, dict) else mp_letters
+        pdf_renderer = None
+        
+        for mp_key, mp_info in letters:
+            base_filename = letter_base_filename(mp_info)
+        
+            # Letters generated without a PDF get one from the batch's renderer
+            if 'pdf' in needed_formats and 'pdf_buffer' not in mp_info:
+                with report.stage('pdf_render'):
+                    if pdf_renderer is None:
+                        pdf_renderer = get_pdf_renderer()
+                    pdf_bytes = pdf_renderer.render(letter_slots(mp_info['mp_data']))
+            elif 'pdf' in needed_formats:
+                pdf_bytes = mp_info['pdf_buffer'].getvalue()
+        
+            entries = {}
+            with report.stage('zip_compress'):
+                if 'docx' in needed_formats:
+                    # A DOCX is itself a ZIP of deflated parts, so deflating it again saves little
+                    entries['docx'] = compress_entry(f"{base_filename}.docx", mp_info['doc_buffer'].getvalue(), zipfile.ZIP_STORED)
+                if 'html' in needed_formats:
+                    entries['html'] = compress_entry(f"{base_filename}.html", mp_info['html_buffer'].getvalue())
+                if 'pdf' in needed_formats:
+                    # PDF page content is already deflated, so it is stored as-is
+                    entries['pdf'] = compress_entry(f"{base_filename}.pdf", pdf_bytes, zipfile.ZIP_STORED)
+        
+            with report.stage('zip_write'):
+                for format_type, writer in writers.items():
+                    for letter_format in ARCHIVE_FORMATS[format_type]:
+                        writer.write_entry(entries[letter_format])
+        
+        with report.stage('zip_write'):
+            for format_type, writer in writers.items():
+                writer.close()
+                zip_buffers[format_type].seek(0)
+    except BaseException:
+        # A failed run leaves no half-written archive behind
+        for format_type, zip_buffer in zip_buffers.items():
+            _discard_archive_output(outputs.get(format_type), zip_buffer)
+        raise
+    
+    return zip_buffers
+
+def create_zip_file(mp_letters, format_type='both', output=None, report=NULL_REPORT):
+    """Create a ZIP file containing letter files
+    
+    Accepts the same letters as create_zip_files and writes to `output` (a
+    path or binary file object) or a spooled temporary file. Returns the open
+    file, rewound to the start.
+    """
+    return create_zip_files(mp_letters, (format_type,), {format_type: output}, report)[format_type]
+
+def create_merged_docx(mp_datas, output=None, report=NULL_REPORT):
+    """Create a single DOCX holding every MP's letter, each in its own section, for printing in one go
+    
+    `mp_datas` is an iterable of normalized MP dicts, consumed one at a time.
+    Writes to `output` (a path or binary file object) or a spooled temporary
+    file and returns the open file rewound to the start.
+    """
+    merged_file = _open_archive_output(output)
+    try:
+        with report.stage('merged_docx'):
+            count = get_compiled_docx_template().render_merged(
+                (letter_slots(mp_data) for mp_data in mp_datas), merged_file
+            )
+    except BaseException:
+        _discard_archive_output(output, merged_file)
+        raise
+    report.count('letters_merged', count)
+    merged_file.seek(0)
+    return merged_file
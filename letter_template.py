@@ -0,0 +1,215 @@
+"""Parse the letter's source template, the one place its wording lives.
+
+The template is a plain text file of blocks with {{slot}} placeholders and
+**bold** / _italic_ markup (see letter_template.txt for the syntax). It is
+parsed once into blocks of styled runs, which letter_generator compiles into
+the DOCX and HTML render plans. Parsed templates are cached by the file's
+content hash, so editing or swapping the file takes effect on the next run
+without a code change or a restart.
+"""
+import hashlib
+import html
+import os
+import re
+import threading
+from typing import NamedTuple
+
+# Template used unless the LETTER_TEMPLATE environment variable names another file
+DEFAULT_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'letter_template.txt')
+
+TEMPLATE_ENV_VAR = 'LETTER_TEMPLATE'
+
+# Placeholders a template may use; letter_generator.letter_slots fills them
+TEMPLATE_SLOTS = (
+    'date', 'first_name', 'last_name', 'electorate', 'full_salutation', 'salutation', 'percentage_text'
+)
+
+# Block roles a template may give with [role]; 'list' comes from "- " lines
+BLOCK_ROLES = (
+    'paragraph', 'date', 'address', 'salutation', 'heading',
+    'signature', 'signature-name', 'signature-title', 'footer'
+)
+
+SLOT_PATTERN = re.compile(r'\{\{(\w+)\}\}')
+ROLE_PATTERN = re.compile(r'\[([\w-]+)\]\s*')
+INLINE_PATTERN = re.compile(r'\*\*(.+?)\*\*|(?<!\w)_(.+?)_(?!\w)')
+
+# HTML element and class each block role becomes
+HTML_BLOCKS = {
+    'paragraph': ('p', None),
+    'date': ('div', 'date'),
+    'address': ('div', 'address'),
+    'salutation': ('div', 'salutation'),
+    'heading': ('div', 'section-heading'),
+    'signature': ('div', 'signature'),
+    'signature-name': ('div', 'signature-name'),
+    'signature-title': ('div', None),
+    'footer': ('div', 'footer'),
+}
+
+class TemplateError(ValueError):
+    """The letter template can't be parsed"""
+
+class Run(NamedTuple):
+    """Text with one style; a slot run's text is its {{slot}} marker and a line break's is '\\n'"""
+    text: str
+    bold: bool = False
+    italic: bool = False
+    slot: str = None
+
+class Block(NamedTuple):
+    """A paragraph-level piece of the letter: its role and one list of runs per line item"""
+    role: str
+    items: list
+
+def _is_comment(line):
+    return line == '#' or line.startswith('# ')
+
+def parse_runs(text):
+    """Split one line of template text into styled runs, with each slot as a run of its own"""
+    runs = []
+    position = 0
+    for match in INLINE_PATTERN.finditer(text):
+        runs += _slot_runs(text[position:match.start()], False, False)
+        if match.group(1) is not None:
+            runs += _slot_runs(match.group(1), True, False)
+        else:
+            runs += _slot_runs(match.group(2), False, True)
+        position = match.end()
+    runs += _slot_runs(text[position:], False, False)
+    return runs
+
+def _slot_runs(text, bold, italic):
+    runs = []
+    pieces = SLOT_PATTERN.split(text)
+    for index, piece in enumerate(pieces):
+        if index % 2:
+            if piece not in TEMPLATE_SLOTS:
+                raise TemplateError(
+                    f"Unknown placeholder {{{{{piece}}}}} in letter template; "
+                    f"expected one of {', '.join(TEMPLATE_SLOTS)}"
+                )
+            runs.append(Run(f"{{{{{piece}}}}}", bold, italic, piece))
+        elif piece:
+            runs.append(Run(piece, bold, italic))
+    return runs
+
+def _lines_runs(lines):
+    """Join lines into one list of runs with line breaks between them"""
+    runs = []
+    for index, line in enumerate(lines):
+        if index:
+            runs.append(Run('\n'))
+        runs += parse_runs(line.strip())
+    return runs
+
+def _parse_group(lines):
+    """Turn one blank-line-separated group of lines into blocks"""
+    first = lines[0]
+    if first.startswith('## '):
+        blocks = [Block('heading', [parse_runs(first[3:].strip())])]
+        return blocks + (_parse_group(lines[1:]) if lines[1:] else [])
+
+    if first.startswith('- '):
+        items = []
+        for line in lines:
+            if line.startswith('- '):
+                items.append([line[2:].strip()])
+            else:
+                items[-1].append(line)
+        return [Block('list', [_lines_runs(item) for item in items])]
+
+    role = 'paragraph'
+    match = ROLE_PATTERN.match(first)
+    if match:
+        role = match.group(1)
+        if role not in BLOCK_ROLES:
+            raise TemplateError(f"Unknown block role [{role}] in letter template; expected one of {', '.join(BLOCK_ROLES)}")
+        lines = [first[match.end():]] + lines[1:]
+    return [Block(role, [_lines_runs(lines)])]
+
+class LetterTemplate:
+    """A parsed letter template, identified by the hash of its source text"""
+
+    def __init__(self, text):
+        self.digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        self.blocks = []
+        group = []
+        for line in text.splitlines() + ['']:
+            line = line.rstrip()
+            if _is_comment(line):
+                continue
+            if line.strip():
+                group.append(line)
+            elif group:
+                self.blocks += _parse_group(group)
+                group = []
+        if not self.blocks:
+            raise TemplateError("The letter template has no content")
+
+        # The footer is repeated in the DOCX page footer, which has no slots
+        footer_runs = [run for block in self.blocks if block.role == 'footer' for item in block.items for run in item]
+        if any(run.slot for run in footer_runs):
+            raise TemplateError("The [footer] block is repeated in the page footer, so it can't contain placeholders")
+        self.footer_text = ''.join(run.text for run in footer_runs)
+
+    def html_body(self, indent='    '):
+        """Return the letter body as HTML with the {{slot}} markers left in place"""
+        parts = []
+        for block in self.blocks:
+            if block.role == 'list':
+                items = ''.join(f"{indent}    <li>{_runs_html(item)}</li>\n" for item in block.items)
+                parts.append(f"{indent}<ul>\n{items}{indent}</ul>")
+                continue
+            tag, class_name = HTML_BLOCKS[block.role]
+            attributes = f' class="{class_name}"' if class_name else ''
+            parts.append(f"{indent}<{tag}{attributes}>{_runs_html(block.items[0])}</{tag}>")
+        return f"\n{indent}\n".join(parts)
+
+def _runs_html(runs):
+    pieces = []
+    for run in runs:
+        if run.text == '\n':
+            pieces.append('<br>')
+            continue
+        text = run.text if run.slot else html.escape(run.text, quote=False)
+        if run.italic:
+            text = f"<em>{text}</em>"
+        if run.bold:
+            text = f"<strong>{text}</strong>"
+        pieces.append(text)
+    return ''.join(pieces)
+
+# {path: (mtime_ns, size, template)} and {digest: template}
+_loaded = {}
+_parsed = {}
+_lock = threading.Lock()
+
+def template_path():
+    """Return the path of the letter template in use"""
+    return os.environ.get(TEMPLATE_ENV_VAR) or DEFAULT_TEMPLATE_PATH
+
+def load_letter_template(path=None):
+    """Return the parsed template, re-reading the file only when it changes
+
+    Parsed templates are cached by content hash, so switching back to a file
+    seen before (or touching one without editing it) doesn't parse it again.
+    """
+    path = path or template_path()
+    stat = os.stat(path)
+    with _lock:
+        loaded = _loaded.get(path)
+    if loaded is not None and loaded[:2] == (stat.st_mtime_ns, stat.st_size):
+        return loaded[2]
+
+    with open(path, encoding='utf-8-sig') as template_file:
+        text = template_file.read()
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    with _lock:
+        template = _parsed.get(digest)
+    if template is None:
+        template = LetterTemplate(text)
+    with _lock:
+        _parsed[digest] = template
+        _loaded[path] = (stat.st_mtime_ns, stat.st_size, template)
+    return template
@@ -0,0 +1,332 @@
+"""Render letters as PDF from the HTML letter template, without a browser.
+
+The HTML template's markup and CSS are compiled once into a layout plan: blocks
+of styled text with their margins, indents and bullets. Blocks without slots
+are line-broken at compile time, so rendering a letter only lays out the few
+per-MP values and draws the prepared lines with fpdf2's built-in Helvetica.
+A renderer loads the fonts and logo once and is reused for every letter in a
+batch. fpdf2 is imported when the first renderer is built.
+"""
+import io
+import re
+import threading
+import unicodedata
+from html.parser import HTMLParser
+
+# A4 page and margins, in millimetres
+PAGE_WIDTH = 210
+PAGE_HEIGHT = 297
+PAGE_MARGIN = 20
+
+# Body text, from the template's body CSS (10pt, line-height 1.4)
+FONT_FAMILY = 'Helvetica'
+FONT_SIZE_PT = 10
+LINE_HEIGHT = FONT_SIZE_PT * 1.4 * 25.4 / 72
+
+# Width of the header logo (the template's 150px)
+LOGO_WIDTH = 40
+
+# Millimetres per CSS unit
+CSS_UNITS = {'px': 25.4 / 96, 'pt': 25.4 / 72, 'em': FONT_SIZE_PT * 25.4 / 72}
+
+# Browser default margins for elements the template's CSS doesn't set
+DEFAULT_MARGINS = {'p': ('1em', '1em'), 'ul': ('1em', '1em')}
+
+# Elements that start a new block of text
+BLOCK_TAGS = {'div', 'p', 'ul', 'li'}
+
+# Slot markers in the template, as in CompiledHtmlTemplate
+SLOT_PATTERN = re.compile(r'\{\{(\w+)\}\}')
+
+# Encoding of the built-in fonts; Windows-1252 adds curly quotes, dashes and bullets to Latin-1
+CORE_FONTS_ENCODING = 'windows-1252'
+
+# Typographic characters outside the PDF core fonts' encoding, with stand-ins
+CHARACTER_FALLBACKS = str.maketrans({'\u2010': '-', '\u2011': '-', '\u2212': '-', '\u202f': ' '})
+
+def _css_length(value):
+    """Convert a CSS length such as '15px' or '1em' to millimetres"""
+    match = re.fullmatch(r'(-?[\d.]+)(px|pt|em)?', value.strip())
+    if match is None:
+        return 0.0
+    return float(match.group(1)) * CSS_UNITS.get(match.group(2) or 'px', 0)
+
+def _parse_declarations(css):
+    """Return the font style ('B', 'I' or both), (top, bottom) margins and left padding a CSS rule sets"""
+    style = ''
+    margins = [None, None]
+    padding_left = None
+    for declaration in css.split(';'):
+        if ':' not in declaration:
+            continue
+        prop, value = (part.strip() for part in declaration.split(':', 1))
+        if prop == 'font-weight' and value == 'bold':
+            style += 'B'
+        elif prop == 'font-style' and value == 'italic':
+            style += 'I'
+        elif prop == 'margin':
+            lengths = value.split()
+            margins = [_css_length(lengths[0]), _css_length(lengths[2] if len(lengths) > 2 else lengths[0])]
+        elif prop == 'margin-top':
+            margins[0] = _css_length(value)
+        elif prop == 'margin-bottom':
+            margins[1] = _css_length(value)
+        elif prop == 'padding-left':
+            padding_left = _css_length(value)
+    return style, margins, padding_left
+
+def _pdf_text(text):
+    """Make text drawable with the core fonts, replacing characters they cannot encode"""
+    if text.isascii():
+        return text
+    text = text.translate(CHARACTER_FALLBACKS)
+    try:
+        text.encode('cp1252')
+        return text
+    except UnicodeEncodeError:
+        pass
+    characters = []
+    for character in text:
+        try:
+            character.encode('cp1252')
+        except UnicodeEncodeError:
+            # Keep the base letter of accented characters, e.g. 'ă' -> 'a'
+            character = unicodedata.normalize('NFKD', character)[0]
+            if not character.isascii():
+                character = '?'
+        characters.append(character)
+    return ''.join(characters)
+
+class _Block:
+    """A run of text laid out as one paragraph"""
+
+    def __init__(self, margin_top, indent, bullet):
+        self.margin_top = margin_top
+        self.indent = indent
+        self.bullet = bullet
+        # (text, style, slot) runs; text is a slot name when slot is True
+        self.runs = []
+        self.lines = None
+
+    @property
+    def has_slots(self):
+        return any(slot for text, style, slot in self.runs)
+
+class _TemplateParser(HTMLParser):
+    """Turn the HTML letter's body into blocks, applying the template's CSS classes"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tag_rules = {}
+        self.class_rules = {}
+        self.title = ''
+        self.blocks = []
+        self.stack = []
+        self.pending_margin = 0.0
+        self.indent = 0.0
+        self.in_style = self.in_title = False
+        self.current = None
+
+    def _style(self):
+        return ''.join(sorted(set(''.join(entry[1] for entry in self.stack))))
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('br', 'img', 'meta'):
+            if tag == 'br' and self.current is not None:
+                self.current.runs.append(('\n', '', False))
+            return
+        if tag == 'style':
+            self.in_style = True
+        elif tag == 'title':
+            self.in_title = True
+
+        # Element rules apply first, then class rules, then the inline style
+        attrs = dict(attrs)
+        rules = [self.tag_rules.get(tag)]
+        rules += [self.class_rules.get(class_name) for class_name in (attrs.get('class') or '').split()]
+        rules.append(_parse_declarations(attrs.get('style', '')))
+        style, margins, padding_left = '', [None, None], 0.0
+        for rule in rules:
+            if rule is None:
+                continue
+            rule_style, rule_margins, rule_padding = rule
+            style += rule_style
+            margins = [new if new is not None else old for old, new in zip(margins, rule_margins)]
+            padding_left = rule_padding if rule_padding is not None else padding_left
+        if tag in ('em', 'i'):
+            style += 'I'
+        elif tag in ('strong', 'b'):
+            style += 'B'
+        default_top, default_bottom = DEFAULT_MARGINS.get(tag, ('0', '0'))
+        margin_top = margins[0] if margins[0] is not None else _css_length(default_top)
+        margin_bottom = margins[1] if margins[1] is not None else _css_length(default_bottom)
+
+        if tag in BLOCK_TAGS:
+            self.current = None
+            self.pending_margin = max(self.pending_margin, margin_top)
+        self.indent += padding_left
+        self.stack.append((tag, style, margin_bottom, padding_left, 'header-logo' in (attrs.get('class') or '')))
+
+    def handle_endtag(self, tag):
+        if tag == 'style':
+            self.in_style = False
+        elif tag == 'title':
+            self.in_title = False
+        if not self.stack or self.stack[-1][0] != tag:
+            return
+        tag, style, margin_bottom, padding_left, is_logo = self.stack.pop()
+        if is_logo:
+            self.blocks.append('logo')
+        if tag in BLOCK_TAGS:
+            self.current = None
+            self.pending_margin = max(self.pending_margin, margin_bottom)
+        self.indent -= padding_left
+
+    def handle_data(self, data):
+        if self.in_style:
+            for selector, css in re.findall(r'([.\w-]+)\s*\{([^}]*)\}', data):
+                if selector.startswith('.'):
+                    self.class_rules[selector[1:]] = _parse_declarations(css)
+                else:
+                    self.tag_rules[selector] = _parse_declarations(css)
+            return
+        if self.in_title:
+            self.title += data
+            return
+        if any(entry[4] for entry in self.stack) or not data.strip() and self.current is None:
+            return
+
+        if self.current is None:
+            in_list_item = any(entry[0] == 'li' for entry in self.stack)
+            self.current = _Block(self.pending_margin, self.indent, in_list_item)
+            self.pending_margin = 0.0
+            self.blocks.append(self.current)
+
+        # Whitespace collapses as it does in the browser; slots keep their own line breaks
+        style = self._style()
+        text = re.sub(r'\s+', ' ', data)
+        if not self.current.runs or self.current.runs[-1][0] == '\n':
+            text = text.lstrip()
+        pieces = SLOT_PATTERN.split(text)
+        for index, piece in enumerate(pieces):
+            if index % 2:
+                self.current.runs.append((piece, style, True))
+            elif piece:
+                self.current.runs.append((piece, style, False))
+
+class PdfLetterRenderer:
+    """The HTML letter compiled into a PDF layout plan, with its fonts and logo loaded once
+
+    Create one per batch (or use get_pdf_renderer()) and call render() for
+    each letter. Per-MP values keep their line breaks, as in the DOCX letter.
+    """
+
+    def __init__(self, template_text, logo_bytes):
+        try:
+            from fpdf import FPDF
+        except ImportError:
+            raise ImportError("PDF output requires fpdf2 (pip install fpdf2)") from None
+        self.FPDF = FPDF
+
+        parser = _TemplateParser()
+        parser.feed(template_text)
+        self.title_pieces = SLOT_PATTERN.split(parser.title.strip())
+        self.blocks = [block for block in parser.blocks if block == 'logo' or block.runs]
+        self.word_widths = {}
+        # Background jobs may render with the same renderer from several threads
+        self.measure_lock = threading.Lock()
+
+        # Measure text and decode the logo with a scratch document, then reuse both
+        self.measure = FPDF(unit='mm', format='A4')
+        self.measure.core_fonts_encoding = CORE_FONTS_ENCODING
+        self.measure.add_page()
+        logo_info = self.measure.image(io.BytesIO(logo_bytes), x=0, y=0, w=LOGO_WIDTH)
+        self.logo_name = next(iter(self.measure.image_cache.images))
+        self.logo_info = self.measure.image_cache.images[self.logo_name]
+        self.logo_height = logo_info.rendered_height
+
+        # Lay out the blocks that are the same in every letter
+        for block in self.blocks:
+            if block != 'logo' and not block.has_slots:
+                block.lines = self._layout(block, {})
+
+    def _width(self, text, style):
+        """Return the width of text in a style, measuring each distinct word once"""
+        key = (text, style)
+        width = self.word_widths.get(key)
+        if width is None:
+            with self.measure_lock:
+                self.measure.set_font(FONT_FAMILY, style, FONT_SIZE_PT)
+                width = self.measure.get_string_width(text)
+            self.word_widths[key] = width
+        return width
+
+    def _layout(self, block, values):
+        """Break a block into lines of (x offset, text, style) fragments"""
+        width = PAGE_WIDTH - 2 * PAGE_MARGIN - block.indent
+        lines = [[]]
+        x = 0.0
+        space = False
+        for text, style, slot in block.runs:
+            if slot:
+                text = _pdf_text(values[text])
+            for token in re.findall(r'\n|[^\S\n]+|[^\s]+', text):
+                if token == '\n':
+                    lines.append([])
+                    x, space = 0.0, False
+                    continue
+                if token.isspace():
+                    space = bool(lines[-1])
+                    continue
+                space_width = self._width(' ', style) if space else 0.0
+                word_width = self._width(token, style)
+                if lines[-1] and x + space_width + word_width > width:
+                    lines.append([])
+                    x, space_width = 0.0, 0.0
+                line = lines[-1]
+                # Extend the previous fragment when the style is unchanged
+                if line and line[-1][2] == style:
+                    offset, previous, previous_style = line[-1]
+                    line[-1] = (offset, previous + (' ' if space_width else '') + token, style)
+                else:
+                    line.append((x + space_width, token, style))
+                x += space_width + word_width
+                space = False
+        return lines
+
+    def render(self, values):
+        """Return one letter as PDF bytes, with `values` filling the template's slots"""
+        pdf = self.FPDF(unit='mm', format='A4')
+        pdf.core_fonts_encoding = CORE_FONTS_ENCODING
+        pdf.set_auto_page_break(False)
+        pdf.set_title(''.join(
+            values[piece] if index % 2 else piece for index, piece in enumerate(self.title_pieces)
+        ))
+        pdf.add_page()
+        # Reuse the logo decoded when the renderer was built
+        pdf.image_cache.images[self.logo_name] = type(self.logo_info)(self.logo_info, usages=0)
+
+        y = PAGE_MARGIN
+        for block in self.blocks:
+            if block == 'logo':
+                pdf.image(self.logo_name, x=PAGE_WIDTH - PAGE_MARGIN - LOGO_WIDTH, y=y, w=LOGO_WIDTH)
+                y += self.logo_height
+                continue
+
+            y += block.margin_top
+            lines = block.lines if block.lines is not None else self._layout(block, values)
+            left = PAGE_MARGIN + block.indent
+            for index, line in enumerate(lines):
+                if y + LINE_HEIGHT > PAGE_HEIGHT - PAGE_MARGIN:
+                    pdf.add_page()
+                    y = PAGE_MARGIN
+                baseline = y + LINE_HEIGHT * 0.72
+                if block.bullet and index == 0:
+                    pdf.set_font(FONT_FAMILY, '', FONT_SIZE_PT)
+                    pdf.text(left - 4, baseline, '•')
+                for offset, text, style in line:
+                    pdf.set_font(FONT_FAMILY, style, FONT_SIZE_PT)
+                    pdf.text(left + offset, baseline, text)
+                y += LINE_HEIGHT
+
+        return bytes(pdf.output())
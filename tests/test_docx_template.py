@@ -0,0 +1,34 @@
+import io
+import zipfile
+from xml.etree import ElementTree
+
+import docx
+
+from letter_generator import create_letter_from_template, get_compiled_docx_template, get_percentage_text
+
+MP = {
+    'first_name': 'Zoë', 'last_name': "O'Neil & <Co>", 'electorate': 'Tāmaki',
+    'full_salutation': "Senator Zoë O'Neil\nSenator for the NT", 'salutation': 'Dear Senator "O\'Neil" & team',
+    'percentage_electorate': '26.18%',
+}
+
+def test_filled_slots_round_trip_through_python_docx():
+    doc_bytes = create_letter_from_template(MP).getvalue()
+
+    with zipfile.ZipFile(io.BytesIO(doc_bytes)) as package:
+        assert package.testzip() is None
+        ElementTree.fromstring(package.read('word/document.xml'))
+        parts = {info.filename: package.read(info) for info in package.infolist()}
+
+    text = '\n'.join(paragraph.text for paragraph in docx.Document(io.BytesIO(doc_bytes)).paragraphs)
+    assert MP['full_salutation'] in text
+    assert MP['salutation'] in text
+    assert get_percentage_text(MP) in text
+    assert '{{' not in text
+
+    # Every part but the document is the template's own, spliced in unchanged
+    template = get_compiled_docx_template()
+    assert list(parts) == [name for name, data in template.parts]
+    for name, data in template.parts:
+        if name != template.DOCUMENT_PART:
+            assert parts[name] == data
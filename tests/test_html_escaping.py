@@ -0,0 +1,27 @@
+from letter_generator import CompiledHtmlTemplate, create_html_letter, letter_slots
+
+NAME = '<script>alert("x")</script>'
+ELECTORATE = 'Fisher & "Co" <North>'
+MP = {
+    'first_name': 'Zoë', 'last_name': NAME, 'electorate': ELECTORATE,
+    'full_salutation': f'Zoë Smith MP\nMember for {ELECTORATE}', 'salutation': f'Dear {NAME}',
+    'percentage_electorate': '26.18%',
+}
+
+def test_letter_escapes_name_and_electorate():
+    text = create_html_letter(MP).getvalue().decode('utf-8')
+
+    assert '<script>' not in text
+    assert '"x"' not in text
+    assert '&lt;script&gt;alert(&quot;x&quot;)&lt;/script&gt;' in text
+    assert 'Member for Fisher &amp; &quot;Co&quot; &lt;North&gt;' in text
+    assert 'Zoë' in text
+
+def test_slots_are_escaped_inside_attributes():
+    template = CompiledHtmlTemplate('<p title="{{electorate}}">{{first_name}} {{last_name}}</p>')
+    text = template.render(letter_slots(MP)).decode('utf-8')
+
+    assert text == (
+        '<p title="Fisher &amp; &quot;Co&quot; &lt;North&gt;">'
+        'Zoë &lt;script&gt;alert(&quot;x&quot;)&lt;/script&gt;</p>'
+    )
@@ -0,0 +1,42 @@
+import os
+
+import pandas as pd
+
+from incremental import MANIFEST_NAME, IncrementalBuild
+
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test_mp_data.csv')
+
+def read_sample():
+    return pd.read_csv(SAMPLE_CSV, dtype=str)
+
+def letter_files(output_dir):
+    return {name: os.stat(os.path.join(output_dir, name)).st_mtime_ns
+            for name in os.listdir(output_dir) if name != MANIFEST_NAME}
+
+def test_update_reuses_unchanged_letters_and_prunes_removed_ones(tmp_path):
+    output_dir = str(tmp_path / 'letters')
+    mps = read_sample()
+
+    changes = IncrementalBuild(output_dir).update(mps)
+    assert len(changes['added']) == len(mps)
+    assert changes['unchanged'] == 0
+    before = letter_files(output_dir)
+    assert len(before) == 2 * len(mps)
+
+    # Drop the last MP and change the first one's share
+    edited = mps.iloc[:-1].copy()
+    edited.loc[0, 'percentage_electorate'] = '99%'
+    build = IncrementalBuild(output_dir)
+    changes = build.update(edited)
+
+    assert changes['added'] == []
+    assert len(changes['changed']) == 1
+    assert len(changes['removed']) == 1
+    assert changes['unchanged'] == len(mps) - 2
+
+    after = letter_files(output_dir)
+    assert len(after) == 2 * (len(mps) - 1)
+    assert set(after) < set(before)
+    rewritten = {name for name in after if after[name] != before[name]}
+    assert len(rewritten) == 2
+    assert len(list(build.iter_letters())) == len(mps) - 1
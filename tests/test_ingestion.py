@@ -0,0 +1,36 @@
+import re
+
+import pytest
+from openpyxl import Workbook
+
+from ingestion import iter_mp_frames
+from letter_generator import create_html_letter, iter_mp_records
+
+HEADER = ['full_salutation', 'salutation', 'First name', 'Last name', 'State/Electorate', 'percentage_electorate']
+ROW = ['Ms Jodie Belyea MP', None, 'Jodie', 'Belyea', 'Dunkley', None]
+
+def write_csv(path):
+    cells = ['' if value is None else value for value in ROW]
+    path.write_text(','.join(HEADER) + '\n' + ','.join(cells) + '\n', encoding='utf-8')
+
+def write_excel(path):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(HEADER)
+    # The trailing blank cell isn't stored at all, so the row is shorter than the header
+    sheet.append(ROW[:-1])
+    workbook.save(path)
+
+@pytest.mark.parametrize('name, write', [('mps.csv', write_csv), ('mps.xlsx', write_excel)])
+def test_blank_cells_are_read_as_empty_text(tmp_path, name, write):
+    path = tmp_path / name
+    write(path)
+
+    frame = next(iter_mp_frames(str(path)))
+    assert frame.loc[0, 'salutation'] == ''
+    assert frame.loc[0, 'percentage_electorate'] == ''
+
+    mp_key, mp_data, base_filename = next(iter_mp_records(iter_mp_frames(str(path))))
+    text = create_html_letter(mp_data).getvalue().decode('utf-8')
+    assert not re.search(r'\b(None|nan)\b', text)
+    assert 'Many of your constituents' in text
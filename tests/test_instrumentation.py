@@ -0,0 +1,34 @@
+import tracemalloc
+
+from instrumentation import RunReport
+
+def test_only_one_report_tracks_memory_at_a_time():
+    first = RunReport(track_memory=True)
+    second = RunReport(track_memory=True)
+    assert first.memory_tracked and not second.memory_tracked
+
+    with second.stage('render'):
+        pass
+    second.finish()
+    assert tracemalloc.is_tracing()
+    assert 'bytes_allocated' not in second.to_dict()['stages']['render']
+
+    first.finish()
+    assert not tracemalloc.is_tracing()
+    third = RunReport(track_memory=True)
+    assert third.memory_tracked
+    third.finish()
+
+def test_nested_stage_keeps_the_outer_peak():
+    report = RunReport(track_memory=True)
+    with report.stage('zip_build'):
+        block = bytearray(4 * 1024 * 1024)
+        del block
+        with report.stage('zip_compress'):
+            pass
+    report.finish()
+
+    stages = report.to_dict()['stages']
+    assert stages['zip_build']['peak_bytes'] >= 4 * 1024 * 1024
+    assert 'peak_bytes' not in stages['zip_compress']
+    assert 'bytes_allocated' in stages['zip_compress']
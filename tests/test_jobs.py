@@ -0,0 +1,74 @@
+import io
+import json
+import os
+import time
+import zipfile
+
+import pytest
+
+import jobs
+from artifact_store import ArtifactStore
+from jobs import DONE, FAILED, JOB_FILE, PACKAGING, QUEUED, RUNNING, Job, JobRunner
+from letter_generator import LetterCache
+
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test_mp_data.csv')
+
+@pytest.fixture
+def runner(tmp_path, monkeypatch):
+    # Keep letters out of the app's own letter store
+    monkeypatch.setattr(jobs, 'letter_cache', LetterCache(store=ArtifactStore(str(tmp_path / 'store'))))
+    return JobRunner(str(tmp_path / 'jobs'))
+
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for the job"
+        time.sleep(0.01)
+
+def test_job_runs_through_its_statuses_and_builds_archives_on_request(runner, monkeypatch):
+    statuses = []
+    update = Job.update
+    def record_update(job, **changes):
+        if 'status' in changes:
+            statuses.append(changes['status'])
+        update(job, **changes)
+    monkeypatch.setattr(Job, 'update', record_update)
+
+    job_id = runner.submit(SAMPLE_CSV, 'mps.csv')
+    job = runner.get(job_id)
+    wait_for(lambda: job.status in (DONE, FAILED))
+
+    assert job.state['error'] is None
+    assert statuses == [RUNNING, PACKAGING, DONE]
+    assert job.state['rows_total'] == job.state['letters'] == 5
+    assert job.state['archives'] == []
+    assert list(job.letters())
+
+    runner.build_archive(job, 'docx')
+    wait_for(lambda: not job.state['building'])
+    assert job.state['archives'] == ['docx']
+    with zipfile.ZipFile(io.BytesIO(job.read_archive('docx'))) as archive:
+        assert archive.testzip() is None
+        assert len(archive.namelist()) == 5
+
+def test_job_interrupted_by_a_restart_is_marked_failed(runner):
+    job_id = runner.submit(SAMPLE_CSV, 'mps.csv')
+    job = runner.get(job_id)
+    wait_for(lambda: job.status == DONE)
+
+    # A job on disk that no runner is running was cut off by a restart
+    job_path = os.path.join(job.job_dir, JOB_FILE)
+    with open(job_path, encoding='utf-8') as job_file:
+        state = json.load(job_file)
+    state['status'] = QUEUED
+    with open(job_path, 'w', encoding='utf-8') as job_file:
+        json.dump(state, job_file)
+
+    restarted = JobRunner(runner.root).get(job_id.upper())
+    assert restarted.status == FAILED
+    assert restarted.state['error'] == "Interrupted by a server restart"
+
+def test_unknown_job_ids_are_not_found(runner):
+    assert runner.get('') is None
+    assert runner.get('0123456789ab') is None
+    assert runner.get('../../etc/passwd') is None
@@ -0,0 +1,46 @@
+import os
+import time
+
+from artifact_store import ArtifactStore
+from letter_generator import LetterCache
+
+def letter(fill, size=200):
+    return (fill * size, fill.lower() * size)
+
+def age(store, key, seconds):
+    then = time.time() - seconds
+    for path in store.paths(key):
+        os.utime(path, (then, then))
+
+def test_store_evicts_least_recently_used_letters(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_bytes=1000)
+    store.put('aa01', letter(b'A'))
+    store.put('bb02', letter(b'B'))
+    age(store, 'aa01', 200)
+    age(store, 'bb02', 100)
+
+    # Reading a letter marks it as used, so the other one goes first
+    assert store.get('aa01') == letter(b'A')
+    store.put('cc03', letter(b'C'))
+
+    assert store.get('bb02') is None
+    assert store.get('aa01') == letter(b'A')
+    assert store.get('cc03') == letter(b'C')
+    assert store.size() <= 1000
+
+def test_letter_cache_round_trips_through_memory_and_store(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    cache = LetterCache(max_bytes=1000, store=store)
+    cache.put('aa01', letter(b'A'))
+    cache.put('bb02', letter(b'B'))
+    cache.put('cc03', letter(b'C'))
+
+    # Only the two most recent letters fit in memory, but all three are on disk
+    assert list(cache.entries) == ['bb02', 'cc03']
+    assert cache.total_bytes == 800
+    assert cache.get('aa01') == letter(b'A')
+    assert list(cache.entries) == ['cc03', 'aa01']
+
+    fresh = LetterCache(max_bytes=1000, store=store)
+    assert fresh.get('bb02') == letter(b'B')
+    assert fresh.get('dd04') is None
@@ -0,0 +1,62 @@
+import io
+import zipfile
+from xml.etree import ElementTree
+
+import docx
+import pytest
+
+from letter_generator import create_merged_docx
+from letter_template import TEMPLATE_ENV_VAR
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+MPS = [
+    {'first_name': 'Jodie', 'last_name': 'Belyea', 'electorate': 'Dunkley',
+     'full_salutation': 'Ms Jodie Belyea MP\nMember for Dunkley', 'salutation': 'Dear Ms Belyea',
+     'percentage_electorate': '26.18%'},
+    {'first_name': 'Leah', 'last_name': 'Blyth', 'electorate': 'SA',
+     'full_salutation': 'Senator Leah Blyth\nSenator for South Australia', 'salutation': 'Dear Senator Blyth',
+     'percentage_electorate': ''},
+    {'first_name': 'Sam', 'last_name': 'Birrell', 'electorate': 'Nicholls',
+     'full_salutation': 'Mr Sam Birrell MP', 'salutation': 'Dear Mr Birrell & team <office>',
+     'percentage_electorate': '12%'},
+]
+
+# A swapped template whose last block is a bullet list, so its last paragraph already has properties
+LIST_TEMPLATE = """[date] {{date}}
+
+[salutation] {{salutation}}
+
+Please note:
+
+- **{{percentage_text}}** are carers
+- Ends with a list
+"""
+
+@pytest.fixture(params=['default', 'list'])
+def template(request, monkeypatch, tmp_path):
+    if request.param == 'list':
+        path = tmp_path / 'template.txt'
+        path.write_text(LIST_TEMPLATE, encoding='utf-8')
+        monkeypatch.setenv(TEMPLATE_ENV_VAR, str(path))
+    else:
+        monkeypatch.delenv(TEMPLATE_ENV_VAR, raising=False)
+    return request.param
+
+def test_merged_docx_has_one_valid_section_per_letter(template):
+    merged = create_merged_docx(MPS).read()
+
+    with zipfile.ZipFile(io.BytesIO(merged)) as package:
+        body = ElementTree.fromstring(package.read('word/document.xml')).find(f'{W}body')
+    paragraphs = body.findall(f'{W}p')
+    assert all(len(paragraph.findall(f'{W}pPr')) <= 1 for paragraph in paragraphs)
+    section_breaks = [paragraph for paragraph in paragraphs if paragraph.find(f'{W}pPr/{W}sectPr') is not None]
+    assert len(section_breaks) == len(MPS) - 1
+    assert all(list(paragraph.find(f'{W}pPr'))[-1].tag == f'{W}sectPr' for paragraph in section_breaks)
+    assert body[-1].tag == f'{W}sectPr'
+
+    document = docx.Document(io.BytesIO(merged))
+    assert len(document.sections) == len(MPS)
+    text = '\n'.join(paragraph.text for paragraph in document.paragraphs)
+    for mp in MPS:
+        assert mp['salutation'] in text
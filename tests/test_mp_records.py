@@ -0,0 +1,20 @@
+import os
+
+import pytest
+
+from ingestion import iter_mp_frames
+from letter_generator import iter_mp_records
+
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test_mp_data.csv')
+
+@pytest.mark.parametrize('batch_rows', [1, 2, 1000])
+def test_repeated_mp_keeps_its_first_row(tmp_path, batch_rows):
+    with open(SAMPLE_CSV, encoding='utf-8') as sample:
+        rows = sample.read().rstrip('\n')
+    path = tmp_path / 'mps.csv'
+    path.write_text(rows + '\n"Ms Jodie Belyea MP",Dear Ms Belyea,Jodie,Belyea,Dunkley,99%\n', encoding='utf-8')
+
+    records = list(iter_mp_records(iter_mp_frames(str(path), batch_rows=batch_rows)))
+    belyea = [mp_data for mp_key, mp_data, base_filename in records if mp_data['last_name'] == 'Belyea']
+    assert len(records) == 5
+    assert [mp_data['percentage_electorate'] for mp_data in belyea] == ['26.18%']
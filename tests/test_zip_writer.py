@@ -0,0 +1,82 @@
+import io
+import tracemalloc
+import zipfile
+
+import pytest
+
+import zip_writer
+from letter_generator import create_zip_file
+from zip_writer import RawZipWriter, compress_entry
+
+def write_archive(entries):
+    buffer = io.BytesIO()
+    with RawZipWriter(buffer) as writer:
+        for entry in entries:
+            writer.write_entry(entry)
+    buffer.seek(0)
+    return buffer
+
+def test_round_trip_through_zipfile():
+    files = {
+        'letter.html': b'<p>Dear Ms Belyea</p>' * 50,
+        'stored.pdf': b'%PDF-1.4 already compressed',
+        'Tāmaki, Ōrewa.docx': b'non-ascii name',
+    }
+    buffer = write_archive([
+        compress_entry(name, data, zipfile.ZIP_STORED if name.endswith('.pdf') else zipfile.ZIP_DEFLATED)
+        for name, data in files.items()
+    ])
+    with zipfile.ZipFile(buffer) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == list(files)
+        assert {name: archive.read(name) for name in files} == files
+        assert archive.getinfo('stored.pdf').compress_type == zipfile.ZIP_STORED
+
+def test_more_entries_than_plain_zip_allows():
+    count = zip_writer.ZIP_MAX_ENTRIES + 2
+    buffer = write_archive(compress_entry(f"{index}.txt", str(index).encode()) for index in range(count))
+    with zipfile.ZipFile(buffer) as archive:
+        infos = archive.infolist()
+        assert len(infos) == count
+        assert archive.read(infos[-1]) == str(count - 1).encode()
+
+def test_offsets_past_the_plain_zip_limit(monkeypatch):
+    # Writing 4 GiB is too slow for a test, so lower the limit the ZIP64 records are written past
+    monkeypatch.setattr(zip_writer, 'ZIP_MAX_OFFSET', 100)
+    files = {f"{index}.bin": bytes([index]) * 150 for index in range(5)}
+    buffer = write_archive(compress_entry(name, data, zipfile.ZIP_STORED) for name, data in files.items())
+    with zipfile.ZipFile(buffer) as archive:
+        assert archive.testzip() is None
+        assert {name: archive.read(name) for name in files} == files
+        assert archive.infolist()[-1].header_offset > 100
+
+def test_failed_archive_is_removed(tmp_path):
+    def letters():
+        yield 'a', {'base_filename': 'A', 'doc_buffer': io.BytesIO(b'docx'), 'html_buffer': io.BytesIO(b'html')}
+        raise RuntimeError("row failed")
+
+    output = tmp_path / 'letters.zip'
+    with pytest.raises(RuntimeError):
+        create_zip_file(letters(), 'both', output=str(output))
+    assert not output.exists()
+
+def test_retained_memory_stays_flat_as_entries_grow():
+    def retained_per_entry(count):
+        writer = RawZipWriter(NullFile())
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            for index in range(count):
+                # Incompressible-sized entries, so keeping their data would dominate
+                writer.write_entry(compress_entry(f"{index:05}.pdf", bytes(20_000), zipfile.ZIP_STORED))
+            return (tracemalloc.get_traced_memory()[0] - before) / count
+        finally:
+            tracemalloc.stop()
+
+    # Only the small directory record of each entry is kept, not its 20 KB of data
+    assert retained_per_entry(500) < 1_000
+    assert retained_per_entry(2_000) < 1_000
+
+class NullFile:
+    def write(self, data):
+        return len(data)
@@ -0,0 +1,148 @@
+import struct
+import time
+import zipfile
+import zlib
+from typing import NamedTuple
+
+# Largest entry count and offset a ZIP archive can hold without ZIP64 records
+ZIP_MAX_ENTRIES = 0xFFFF
+ZIP_MAX_OFFSET = 0xFFFFFFFF
+
+# Header ID of the ZIP64 extended information extra field
+ZIP64_EXTRA_ID = 0x0001
+
+# "Version needed to extract" for plain entries and for entries with ZIP64 records
+ZIP_VERSION = 20
+ZIP64_VERSION = 45
+
+class CompressedEntry(NamedTuple):
+    """A file compressed once, ready to be copied into any number of archives"""
+    name: str
+    data: bytes
+    crc: int
+    size: int
+    compress_type: int
+
+class DirectoryRecord(NamedTuple):
+    """What the central directory needs of a written entry, without its data"""
+    name: bytes
+    flags: int
+    crc: int
+    compressed_size: int
+    size: int
+    compress_type: int
+    offset: int
+
+def compress_entry(name, data, compress_type=zipfile.ZIP_DEFLATED):
+    """Compress `data` the way zipfile.writestr would and keep the result for reuse"""
+    if compress_type == zipfile.ZIP_DEFLATED:
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+    elif compress_type == zipfile.ZIP_STORED:
+        compressed = data
+    else:
+        raise ValueError(f"Unsupported compression type: {compress_type}")
+    return CompressedEntry(name, compressed, zlib.crc32(data), len(data), compress_type)
+
+def _dos_timestamp():
+    """Return the current local time as DOS (time, date) fields"""
+    year, month, day, hour, minute, second = time.localtime()[:6]
+    dos_time = (hour << 11) | (minute << 5) | (second // 2)
+    dos_date = ((year - 1980) << 9) | (month << 5) | day
+    return dos_time, dos_date
+
+def _zip64_extra(values):
+    """Return a ZIP64 extended information extra field holding `values` (8 bytes each)"""
+    if not values:
+        return b''
+    return struct.pack(f'<2H{len(values)}Q', ZIP64_EXTRA_ID, 8 * len(values), *values)
+
+class RawZipWriter:
+    """Minimal ZIP writer that copies already-compressed entries into an archive
+
+    Entries are written as-is, so an entry compressed once with compress_entry()
+    can be shared between several archives without deflating it again. Entries
+    and archives past the plain ZIP limits (65,535 files or 4 GiB) get ZIP64
+    records, the same as zipfile writes. Only each entry's DirectoryRecord is
+    kept until close(), so memory doesn't grow with the entries' data.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+        self.central_directory = []
+        self.dos_time, self.dos_date = _dos_timestamp()
+
+    def write_entry(self, entry):
+        """Append one compressed entry to the archive"""
+        name = entry.name.encode('utf-8')
+        flags = 0 if name.isascii() else 0x800
+
+        # Sizes too large for the header go in a ZIP64 extra field; 0xFFFFFFFF marks them
+        zip64 = entry.size > ZIP_MAX_OFFSET or len(entry.data) > ZIP_MAX_OFFSET
+        extra = _zip64_extra([entry.size, len(entry.data)] if zip64 else [])
+        header = struct.pack(
+            '<4s5H3L2H', b'PK\x03\x04', ZIP64_VERSION if zip64 else ZIP_VERSION, flags, entry.compress_type,
+            self.dos_time, self.dos_date, entry.crc,
+            0xFFFFFFFF if zip64 else len(entry.data), 0xFFFFFFFF if zip64 else entry.size,
+            len(name), len(extra)
+        )
+        self.central_directory.append(DirectoryRecord(
+            name, flags, entry.crc, len(entry.data), entry.size, entry.compress_type, self.offset
+        ))
+        self.fileobj.write(header)
+        self.fileobj.write(name)
+        self.fileobj.write(extra)
+        self.fileobj.write(entry.data)
+        self.offset += len(header) + len(name) + len(extra) + len(entry.data)
+
+    def close(self):
+        """Write the central directory and end record, with ZIP64 end records when needed"""
+        directory_offset = self.offset
+        for record in self.central_directory:
+            zip64_values = []
+            size, compressed_size, header_offset = record.size, record.compressed_size, record.offset
+            if size > ZIP_MAX_OFFSET:
+                zip64_values.append(size)
+                size = 0xFFFFFFFF
+            if compressed_size > ZIP_MAX_OFFSET:
+                zip64_values.append(compressed_size)
+                compressed_size = 0xFFFFFFFF
+            if header_offset > ZIP_MAX_OFFSET:
+                zip64_values.append(header_offset)
+                header_offset = 0xFFFFFFFF
+            extra = _zip64_extra(zip64_values)
+            version = ZIP64_VERSION if zip64_values else ZIP_VERSION
+            header = struct.pack(
+                '<4s4B4H3L5H2L', b'PK\x01\x02', version, 3, version, 0, record.flags, record.compress_type,
+                self.dos_time, self.dos_date, record.crc, compressed_size, size,
+                len(record.name), len(extra), 0, 0, 0, 0o600 << 16, header_offset
+            )
+            self.fileobj.write(header)
+            self.fileobj.write(record.name)
+            self.fileobj.write(extra)
+            self.offset += len(header) + len(record.name) + len(extra)
+
+        count = len(self.central_directory)
+        directory_size = self.offset - directory_offset
+        if count >= ZIP_MAX_ENTRIES or directory_size > ZIP_MAX_OFFSET or directory_offset > ZIP_MAX_OFFSET:
+            # ZIP64 end of central directory record, then the locator pointing at it
+            self.fileobj.write(struct.pack(
+                '<4sQ2H2L4Q', b'PK\x06\x06', 44, ZIP64_VERSION, ZIP64_VERSION, 0, 0,
+                count, count, directory_size, directory_offset
+            ))
+            self.fileobj.write(struct.pack('<4sLQL', b'PK\x06\x07', 0, self.offset, 1))
+            count = min(count, 0xFFFF)
+            directory_size = min(directory_size, 0xFFFFFFFF)
+            directory_offset = min(directory_offset, 0xFFFFFFFF)
+
+        self.fileobj.write(struct.pack(
+            '<4s4H2LH', b'PK\x05\x06', 0, 0, count, count, directory_size, directory_offset, 0
+        ))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()